@@ -0,0 +1,46 @@
+import sys
+import timeit
+
+import zero_buffer
+from zero_buffer import Buffer
+
+
+N = 1000
+
+DATA = (b"  GET /index.html HTTP/1.1\r\nHost: example.com\r\n\r\n  " * 64 +
+        b"0123456789" * 64)
+
+OPERATIONS = [
+    ("find", lambda view: view.find(b"example.org")),
+    ("rfind", lambda view: view.rfind(b"GET /about")),
+    ("strip", lambda view: view.strip()),
+    ("strip(chars)", lambda view: view.strip(b" 0123456789")),
+    ("isdigit", lambda view: view[-640:].isdigit()),
+    ("splitlines", lambda view: list(view.splitlines())),
+]
+
+
+def make_view():
+    buf = Buffer.allocate(len(DATA))
+    buf.add_bytes(DATA)
+    return buf.view()
+
+
+def main(argv):
+    backends = argv[1:] or zero_buffer.BACKENDS
+    view = make_view()
+    print("%-14s" % "" + "".join("%12s" % backend for backend in backends))
+    for name, func in OPERATIONS:
+        timings = []
+        for backend in backends:
+            zero_buffer.set_backend(backend)
+            timings.append(min(timeit.repeat(
+                lambda: func(view), number=N, repeat=3
+            )) / N)
+        print("%-14s" % name + "".join(
+            "%10.2fus" % (timing * 1e6) for timing in timings
+        ))
+
+
+if __name__ == "__main__":
+    main(sys.argv)
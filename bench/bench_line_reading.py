@@ -37,11 +37,11 @@ def run_zero_buffer_bench():
             last_pos += read
             collator.append(view)
             if b"\n" in view:
-                data = collator.collapse()
-                last_newline_pos = data.rfind(b"\n")
-                for line in data[:last_newline_pos].split(b"\n"):
+                lines = list(collator.split(b"\n"))
+                for line in lines[:-1]:
                     d[chr(line[0])] += 1
-                collator.append(data[last_newline_pos + 1:])
+                collator = BufferCollator()
+                collator.append(lines[-1])
 
 
 def main(argv):
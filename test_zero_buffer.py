@@ -1,8 +1,28 @@
+import csv
 import errno
+import fcntl
+import gc
+import hashlib
+import io
+import multiprocessing
+import os
+import pickle
+import struct
+import sys
+import zlib
 
 import pytest
+from hypothesis import given, strategies as st
 
-from zero_buffer import Buffer, BufferView, BufferCollator, BufferFull
+import zero_buffer
+from zero_buffer import (
+    Buffer, BufferView, BufferCollator, BufferFull, Compressor, CSVParseError,
+    CSVReader, Decompressor, FrameReader,
+    HTTPParseError, HTTPParser, LatencyHistogram, Matcher, Needle, Profiler,
+    Writer, add_hook, compile_needle, get_backend, live_buffers,
+    parallel_count, parallel_split, read_many, remove_hook, set_backend,
+    set_tracking
+)
 
 
 @pytest.fixture
@@ -10,6 +30,21 @@ def buf():
     return Buffer.allocate(16)
 
 
+@pytest.fixture
+def tracking(request):
+    request.addfinalizer(
+        lambda original=zero_buffer._tracking: set_tracking(original)
+    )
+    set_tracking(True)
+
+
+@pytest.fixture(params=zero_buffer.BACKENDS)
+def backend(request):
+    request.addfinalizer(lambda original=get_backend(): set_backend(original))
+    set_backend(request.param)
+    return request.param
+
+
 class TestBuffer(object):
     def test_read_from(self, buf, tmpdir):
         t = tmpdir.join("t.txt")
@@ -63,11 +98,52 @@ class TestBuffer(object):
         assert res == 16
         assert buf.writepos == 16
 
+    def test_add_bytes_bytearray(self, buf):
+        res = buf.add_bytes(bytearray(b"abc"))
+        assert res == 3
+        assert buf.view() == b"abc"
+
+    def test_add_bytes_view(self, buf):
+        other = Buffer.allocate(8)
+        other.add_bytes(b"xabcx")
+        assert buf.add_bytes(other.view(1, 4)) == 3
+        assert buf.view() == b"abc"
+
     def test_add_bytes_buffer_full(self, buf):
         buf.add_bytes(b"a" * 16)
         with pytest.raises(BufferFull):
             buf.add_bytes(b"abc")
 
+    def test_reserve_commit(self, buf):
+        buf.add_bytes(b"ab")
+        region = buf.reserve(4)
+        assert len(region) == 4
+        region[:3] = b"cde"
+        assert buf.writepos == 2
+        buf.commit(3)
+        assert buf.view() == b"abcde"
+        with pytest.raises(BufferFull):
+            buf.reserve(12)
+        with pytest.raises(ValueError):
+            buf.commit(12)
+        assert len(buf.reserve(11)) == 11
+
+    def test_pack_into(self, buf):
+        buf.add_bytes(b"x")
+        offset = buf.pack_into(">I", 0)
+        assert offset == 1
+        buf.add_bytes(b"body")
+        buf.pack_at(offset, ">I", 4)
+        assert buf.view() == b"x\x00\x00\x00\x04body"
+        assert buf.pack_into("<HB", 258, 3) == 9
+        assert buf.view(9) == b"\x02\x01\x03"
+        with pytest.raises(BufferFull):
+            buf.pack_into(">Q", 0)
+        with pytest.raises(ValueError):
+            buf.pack_at(10, ">I", 0)
+        with pytest.raises(ValueError):
+            buf.pack_at(-1, ">B", 0)
+
     def test_view(self, buf):
         buf.add_bytes(b"abc")
         view = buf.view(0, 3)
@@ -95,7 +171,91 @@ class TestBuffer(object):
         buf.add_bytes(b"abc")
         assert repr(buf) == "Buffer(data=[97, 98, 99], capacity=16, free=13)"
 
+    @pytest.mark.usefixtures("tracking")
+    def test_release(self):
+        buf = Buffer.allocate(16)
+        buf.add_bytes(b"abc123")
+        view = buf.view()
+        sub = view[1:3]
+        buf.release()
+        assert buf.capacity == 0
+        assert buf.writepos == 0
+        assert len(view) == 0
+        assert view == b""
+        assert sub == b""
+        assert bytes(sub) == b""
+        assert sub.find(b"b") == -1
+        assert list(sub) == []
+        with pytest.raises(IndexError):
+            sub[0]
+        assert buf.view() == b""
+        with pytest.raises(BufferFull):
+            buf.add_bytes(b"abc")
 
+    def test_release_untracked(self, monkeypatch):
+        monkeypatch.setattr(zero_buffer, "_tracking", False)
+        b = Buffer.allocate(16)
+        b.add_bytes(b"abc")
+        view = b.view()
+        b.release()
+        assert b.capacity == 0
+        # Without tracking the views can't be emptied, so they keep the
+        # memory alive instead.
+        assert view == b"abc"
+        assert list(view) == [ord(b"a"), ord(b"b"), ord(b"c")]
+        with pytest.raises(ValueError):
+            b.live_views()
+
+    def test_release_keeps_exports(self, buf):
+        buf.add_bytes(b"abc")
+        it = iter(buf.view())
+        buf.release()
+        assert list(it) == [ord(b"a"), ord(b"b"), ord(b"c")]
+
+    @pytest.mark.usefixtures("tracking")
+    def test_context_manager(self):
+        with Buffer.allocate(16) as b:
+            b.add_bytes(b"abc")
+            view = b.view()
+            assert view == b"abc"
+        assert view == b""
+        assert b.capacity == 0
+
+    @pytest.mark.usefixtures("tracking")
+    def test_live_views(self):
+        buf = Buffer.allocate(16)
+        buf.add_bytes(b"abc")
+        assert buf.live_views() == []
+        view = buf.view()
+        sub = view[1:]
+        assert buf.live_views() == [view, sub]
+        del view
+        gc.collect()
+        assert buf.live_views() == [sub]
+
+    @pytest.mark.usefixtures("tracking")
+    def test_live_buffers(self):
+        b = Buffer.allocate(16)
+        view = b.view()
+        assert (b, [view]) in [
+            (buf, views) for buf, views in live_buffers() if buf is b
+        ]
+        del b, view
+        gc.collect()
+        assert all(
+            buf.capacity != 16 or buf.live_views() for buf, _ in live_buffers()
+        )
+
+    @pytest.mark.usefixtures("tracking")
+    def test_many_views_pruned(self):
+        buf = Buffer.allocate(16)
+        buf.add_bytes(b"abc")
+        for _ in range(1000):
+            buf.view()
+        assert len(buf._views) < 100
+
+
+@pytest.mark.usefixtures("backend")
 class TestBufferView(object):
     def test_bytes(self, buf):
         buf.add_bytes(b"abc")
@@ -125,6 +285,43 @@ class TestBufferView(object):
     def test_equality_other(self, buf):
         assert buf.view() != []
 
+    def test_equals_ignore_case(self, buf):
+        buf.add_bytes(b"Host@hOST")
+        assert buf.view(0, 4).equals_ignore_case(b"host")
+        assert buf.view(0, 4).equals_ignore_case(buf.view(5, 9))
+        assert not buf.view(0, 4).equals_ignore_case(b"hostx")
+        assert not buf.view(0, 4).equals_ignore_case(b"post")
+        assert not buf.view(4, 5).equals_ignore_case(b"`")
+
+    def test_detach(self, buf):
+        buf.add_bytes(b"abc123")
+        view = buf.view(1, 4).detach()
+        assert view == b"bc1"
+        assert view._keepalive is not buf
+        assert view._keepalive.capacity == 3
+        buf.release()
+        assert view == b"bc1"
+
+    def test_lower_into(self, buf):
+        buf.add_bytes(b"AbC-1@[")
+        dest = Buffer.allocate(16)
+        dest.add_bytes(b"x")
+        result = buf.view().lower_into(dest)
+        assert result == b"abc-1@["
+        assert dest.view() == b"xabc-1@["
+
+    def test_upper_into(self, buf):
+        buf.add_bytes(b"AbC-1`{")
+        result = buf.view().upper_into(Buffer.allocate(16))
+        assert result == b"ABC-1`{"
+
+    def test_lower_into_full(self, buf):
+        buf.add_bytes(b"ABC")
+        dest = Buffer.allocate(2)
+        with pytest.raises(BufferFull):
+            buf.view().lower_into(dest)
+        assert dest.writepos == 0
+
     def test_contains(self, buf):
         buf.add_bytes(b"abc")
         view = buf.view()
@@ -146,7 +343,8 @@ class TestBufferView(object):
         assert view.find(b"d", 2, 4) == 3
         assert view.find(b"e", 2, 3) == -1
         assert view.find(b"m", 0, 20) == 12
-        assert view.find(b"a", -1) == 0
+        assert view.find(b"a", -1) == -1
+        assert view.find(b"m", -1) == 12
         assert view.find(b"a", 3, 2) == -1
 
     def test_find_empty_bytes(self, buf):
@@ -166,6 +364,19 @@ class TestBufferView(object):
         assert view.find(b"aa") == 6
         assert view.find(b"abb") == 7
 
+    def test_find_ignore_case(self, buf):
+        buf.add_bytes(b"Content-TYPE: x")
+        view = buf.view()
+        assert view.find(b"content-type", ignore_case=True) == 0
+        assert view.find(b"TYPE", ignore_case=True) == 8
+        assert view.find(b"type", ignore_case=True) == 8
+        assert view.find(b"type") == -1
+        assert view.find(b"T", 1, ignore_case=True) == 3
+        assert view.find(b"type", 9, ignore_case=True) == -1
+        assert view.find(b"", 2, ignore_case=True) == 2
+        assert view.find(b"[", ignore_case=True) == -1
+        assert view.index(b"X", ignore_case=True) == 14
+
     def test_index(self, buf):
         buf.add_bytes(b"abc123")
         view = buf.view()
@@ -305,6 +516,72 @@ class TestBufferView(object):
         view = buf.view()
         assert list(view) == [ord(b"a"), ord(b"b"), ord(b"c")]
 
+    def test_iteration_keepalive(self):
+        b = Buffer.allocate(16)
+        b.add_bytes(b"abc")
+        it = iter(b.view(1))
+        del b
+        gc.collect()
+        assert list(it) == [ord(b"b"), ord(b"c")]
+
+    def test_iter_chunks(self, buf):
+        buf.add_bytes(b"abcdefg")
+        view = buf.view()
+        assert list(view.iter_chunks(3)) == [b"abc", b"def", b"g"]
+        assert list(view.iter_chunks(7)) == [b"abcdefg"]
+        assert list(view.iter_chunks(10)) == [b"abcdefg"]
+        assert list(buf.view(0, 0).iter_chunks(3)) == []
+        with pytest.raises(ValueError):
+            view.iter_chunks(0)
+
+    def test_decode(self, buf):
+        buf.add_bytes(u"h\xe9llo".encode("utf-8"))
+        view = buf.view()
+        assert view.decode() == u"h\xe9llo"
+        assert view.decode("latin-1") == u"h\xc3\xa9llo"
+        with pytest.raises(UnicodeDecodeError):
+            view[:2].decode()
+        assert view[:2].decode("utf-8", "replace") == u"h\ufffd"
+
+    def test_is_ascii(self):
+        b = Buffer.allocate(32)
+        b.add_bytes(b"abcdefghijklmnopq\x7f\x80")
+        view = b.view()
+        assert view[:-1].is_ascii()
+        assert not view.is_ascii()
+        assert not view[-1:].is_ascii()
+        assert not view[5:].is_ascii()
+        assert b.view(0, 0).is_ascii()
+
+    @pytest.mark.parametrize(("data", "valid"), [
+        (b"", True),
+        (b"plain ascii text, long enough for a word", True),
+        (u"h\xe9llo \u20ac \U0001f600".encode("utf-8"), True),
+        (u"\U0010ffff".encode("utf-8"), True),
+        (b"\xc3", False),
+        (b"\xc3(", False),
+        (b"\x80", False),
+        (b"\xc0\xaf", False),
+        (b"\xe0\x80\xaf", False),
+        (b"\xed\xa0\x80", False),
+        (b"\xf0\x80\x80\xaf", False),
+        (b"\xf4\x90\x80\x80", False),
+        (b"\xf5\x80\x80\x80", False),
+        (b"\xe2\x82", False),
+        (b"abcdefgh\xff", False),
+    ])
+    def test_is_valid_utf8(self, data, valid):
+        b = Buffer.allocate(64)
+        b.add_bytes(data)
+        view = b.view()
+        assert view.is_valid_utf8() is valid
+        try:
+            data.decode("utf-8")
+        except UnicodeDecodeError:
+            assert not valid
+        else:
+            assert valid
+
     def test_isdigit(self, buf):
         buf.add_bytes(b"123abc")
         assert not buf.view().isdigit()
@@ -331,6 +608,33 @@ class TestBufferView(object):
         with pytest.raises(TypeError):
             view + 3
 
+    def test_crc32(self, buf):
+        buf.add_bytes(b"abc123")
+        view = buf.view()
+        assert view.crc32() == zlib.crc32(b"abc123") & 0xffffffff
+        assert view[3:].crc32(view[:3].crc32()) == view.crc32()
+
+    def test_hash(self, buf):
+        buf.add_bytes(b"abc123")
+        view = buf.view()
+        assert view.hash().digest() == hashlib.sha256(b"abc123").digest()
+        assert view.hash("md5").digest() == hashlib.md5(b"abc123").digest()
+
+    def test_update_hash(self, buf):
+        buf.add_bytes(b"abc123")
+        hasher = hashlib.sha1(b"xyz")
+        buf.view().update_hash(hasher)
+        assert hasher.digest() == hashlib.sha1(b"xyzabc123").digest()
+
+    def test_fast_hash(self, buf):
+        buf.add_bytes(b"abc123abc")
+        view = buf.view()
+        assert buf.view(0, 0).fast_hash() == 0xcbf29ce484222325
+        assert view[:1].fast_hash() == 0xaf63dc4c8601ec8c
+        assert view[:3].fast_hash() == view[6:].fast_hash()
+        assert view[:3].fast_hash() != view[3:6].fast_hash()
+        assert view[3:].fast_hash(view[:3].fast_hash()) == view.fast_hash()
+
     def test_write_to(self, buf, tmpdir):
         buf.add_bytes(b"abcd")
         view = buf.view()
@@ -353,6 +657,126 @@ class TestBufferView(object):
         assert res == 0
         assert tmpdir.join("t.txt").read("rb") == b""
 
+    def test_write_all(self, buf, tmpdir):
+        buf.add_bytes(b"abcd")
+        view = buf.view()
+        with tmpdir.join("t.txt").open("wb") as f:
+            res = view.write_all(f.fileno())
+        assert res == 4
+        assert tmpdir.join("t.txt").read("rb") == b"abcd"
+
+    def test_write_all_nonblocking(self):
+        b = Buffer.allocate(1024 * 1024)
+        b.add_bytes(b"x" * b.capacity)
+        r, w = os.pipe()
+        try:
+            flags = fcntl.fcntl(w, fcntl.F_GETFL)
+            fcntl.fcntl(w, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+            with pytest.raises(io.BlockingIOError) as exc_info:
+                b.view().write_all(w)
+            written = exc_info.value.characters_written
+            assert 0 < written < b.capacity
+            data = b""
+            while len(data) < written:
+                data += os.read(r, written - len(data))
+            assert data == b"x" * written
+        finally:
+            os.close(r)
+            os.close(w)
+
+    def test_write_all_badfd(self, buf):
+        buf.add_bytes(b"abcd")
+        view = buf.view()
+        with pytest.raises(OSError) as exc_info:
+            view.write_all(-1)
+        assert exc_info.value.errno == errno.EBADF
+
+
+class TestNumPy(object):
+    @pytest.fixture
+    def numpy(self):
+        return pytest.importorskip("numpy")
+
+    def test_as_array(self, buf, numpy):
+        buf.add_bytes(b"abc123")
+        array = buf.view()[1:4].as_array()
+        assert array.dtype == numpy.uint8
+        assert list(array) == [ord(b"b"), ord(b"c"), ord(b"1")]
+        with pytest.raises(ValueError):
+            array[0] = 0
+
+    def test_as_array_keepalive(self, numpy):
+        b = Buffer.allocate(16)
+        b.add_bytes(b"\x00\x01\x00\x02")
+        array = b.view().as_array(">u2")
+        del b
+        assert list(array) == [1, 2]
+
+    def test_as_array_itemsize(self, buf, numpy):
+        buf.add_bytes(b"abc")
+        with pytest.raises(ValueError):
+            buf.view().as_array(numpy.uint16)
+
+    def test_as_records(self, buf, numpy):
+        buf.add_bytes(b"a\x00\x01b\x00\x02")
+        records = buf.view().as_records([("tag", "S1"), ("value", ">u2")])
+        assert list(records.tag) == [b"a", b"b"]
+        assert list(records.value) == [1, 2]
+
+    def test_count_bytes(self, buf, numpy):
+        buf.add_bytes(b"aab\xff")
+        counts = buf.view().count_bytes()
+        assert counts.shape == (256,)
+        assert counts[ord(b"a")] == 2
+        assert counts[ord(b"b")] == 1
+        assert counts[255] == 1
+        assert counts.sum() == 4
+
+    @pytest.mark.parametrize(("data", "by", "maxsplit"), [
+        (b"a-b--c", b"-", -1),
+        (b"a-b--c", b"-", 1),
+        (b"-", b"-", -1),
+        (b"", b"-", -1),
+        (b"a::b::::c", b"::", -1),
+        (b"a::b::::c", b"::", 2),
+    ])
+    def test_split_offsets(self, buf, numpy, data, by, maxsplit):
+        buf.add_bytes(data)
+        view = buf.view()
+        offsets = view.split_offsets(by, maxsplit)
+        assert [view[start:stop] for start, stop in offsets] == list(
+            view.split(by, maxsplit)
+        )
+
+    def test_split_offsets_empty(self, buf, numpy):
+        with pytest.raises(ValueError):
+            buf.view().split_offsets(b"")
+
+
+class TestBackends(object):
+    def test_set_backend(self, backend):
+        assert get_backend() == backend
+        assert BufferView.isdigit is BufferView.__dict__[
+            "_%s_isdigit" % backend
+        ]
+
+    def test_unknown_backend(self):
+        with pytest.raises(ValueError):
+            set_backend("fortran")
+
+    def test_default_backend(self, monkeypatch):
+        monkeypatch.delenv("ZERO_BUFFER_BACKEND", raising=False)
+        monkeypatch.setattr(
+            zero_buffer.platform, "python_implementation", lambda: "PyPy"
+        )
+        assert zero_buffer._default_backend() == "python"
+        monkeypatch.setattr(
+            zero_buffer.platform, "python_implementation", lambda: "CPython"
+        )
+        assert zero_buffer._default_backend() == "native"
+        monkeypatch.setenv("ZERO_BUFFER_BACKEND", "python")
+        assert zero_buffer._default_backend() == "python"
+
 
 class TestBufferCollator(object):
     def test_single_item(self, buf):
@@ -370,6 +794,30 @@ class TestBufferCollator(object):
         view = collator.collapse()
         assert len(view) == 0
 
+    def make_collator(self, buf):
+        buf.add_bytes(b"abc123")
+        collator = BufferCollator()
+        collator.append(buf.view(0, 2))
+        collator.append(buf.view(3, 6))
+        expected = Buffer.allocate(5)
+        expected.add_bytes(b"ab123")
+        return collator, expected.view()
+
+    def test_crc32(self, buf):
+        collator, expected = self.make_collator(buf)
+        assert collator.crc32() == expected.crc32()
+
+    def test_update_hash(self, buf):
+        collator, expected = self.make_collator(buf)
+        hasher = hashlib.sha256()
+        collator.update_hash(hasher)
+        assert hasher.digest() == expected.hash("sha256").digest()
+        assert len(collator) == 5
+
+    def test_fast_hash(self, buf):
+        collator, expected = self.make_collator(buf)
+        assert collator.fast_hash() == expected.fast_hash()
+
     def test_len(self, buf):
         buf.add_bytes(b"abc")
         view = buf.view()
@@ -377,3 +825,965 @@ class TestBufferCollator(object):
         collator.append(view)
         collator.append(view)
         assert len(collator) == 6
+
+    def make_segments(self, *chunks):
+        collator = BufferCollator()
+        for chunk in chunks:
+            b = Buffer.allocate(max(len(chunk), 1))
+            b.add_bytes(chunk)
+            collator.append(b.view())
+        return collator
+
+    def test_find(self):
+        collator = self.make_segments(b"ab\r", b"\n", b"\r\nab\r\n\r", b"\n")
+        data = b"ab\r\n\r\nab\r\n\r\n"
+        for needle in [b"\r\n\r\n", b"b\r", b"\n", b"x", b""]:
+            for start in [0, 3, -4]:
+                assert collator.find(needle, start) == data.find(needle, start)
+                assert collator.rfind(needle, start) == data.rfind(
+                    needle, start
+                )
+        assert collator.find(b"\r\n\r\n", 0, 5) == -1
+        assert collator.rfind(b"\r\n\r\n", 0, 7) == 2
+        assert collator.find(b"", 20) == -1
+
+    def test_split(self):
+        first = Buffer.allocate(8)
+        first.add_bytes(b"ab\ncd")
+        second = Buffer.allocate(8)
+        second.add_bytes(b"ef\ngh")
+        collator = BufferCollator()
+        collator.append(first.view())
+        collator.append(second.view())
+        parts = list(collator.split(b"\n"))
+        assert [bytes(part) for part in parts] == [b"ab", b"cdef", b"gh"]
+        # Pieces inside a single view aren't copied.
+        assert parts[0]._keepalive is first
+        assert parts[2]._keepalive is second
+        assert parts[1]._keepalive not in (first, second)
+        assert [bytes(part) for part in collator.split(b"\n", 1)] == [
+            b"ab", b"cdef\ngh"
+        ]
+        assert len(collator) == 10
+
+    def test_split_straddling_separator(self):
+        collator = self.make_segments(b"a\r", b"\nb\r", b"", b"\n")
+        parts = [bytes(part) for part in collator.split(b"\r\n")]
+        assert parts == [b"a", b"b", b""]
+        with pytest.raises(ValueError):
+            collator.split(b"")
+
+
+class TestNeedle(object):
+    def test_bytes_like(self, buf):
+        buf.add_bytes(b"abc")
+        assert bytes(Needle(bytearray(b"ab"))) == b"ab"
+        assert bytes(Needle(buf.view(1))) == b"bc"
+        assert buf.view().find(bytearray(b"bc")) == 1
+
+    @pytest.mark.parametrize("needle", [3, None, u"a"])
+    def test_not_bytes(self, buf, needle):
+        buf.add_bytes(b"abc")
+        with pytest.raises(TypeError):
+            Needle(needle)
+        with pytest.raises(TypeError):
+            buf.view().find(needle)
+        with pytest.raises(TypeError):
+            needle in buf.view()
+
+    def test_find(self, buf):
+        buf.add_bytes(b"abc\r\n\r\nabc")
+        view = buf.view()
+        needle = Needle(b"\r\n\r\n")
+        assert view.find(needle) == 3
+        assert view.rfind(needle) == 3
+        assert view.index(needle) == 3
+        assert needle in view
+        assert Needle(b"bc") not in view[3:8]
+        assert view.find(Needle(b"c")) == 2
+        assert view.rfind(Needle(b"c")) == 9
+
+    def test_tables_built_lazily(self, buf, backend):
+        buf.add_bytes(b"abc\r\n\r\nabc")
+        view = buf.view()
+        needle = Needle(b"\r\n\r\n")
+        assert view.find(needle) == 3
+        assert view.rfind(needle) == 3
+        built = needle._find_mask is not None
+        assert built == (backend == "python")
+        assert (needle._rfind_mask is not None) == built
+
+    def test_split(self, buf):
+        buf.add_bytes(b"a::b::c")
+        view = buf.view()
+        assert list(view.split(Needle(b"::"))) == [b"a", b"b", b"c"]
+        assert list(view.split(Needle(b":"))) == [b"a", b"", b"b", b"", b"c"]
+
+    def test_empty(self, buf):
+        buf.add_bytes(b"abc")
+        view = buf.view()
+        assert view.find(Needle(b"")) == 0
+        with pytest.raises(ValueError):
+            view.split(Needle(b""))
+
+    def test_len(self):
+        assert len(Needle(b"abc")) == 3
+
+    def test_bytes(self):
+        assert bytes(Needle(b"abc")) == b"abc"
+
+    def test_repr(self):
+        assert repr(Needle(b"ab")) == "Needle(%r)" % (b"ab",)
+
+    def test_compile_needle(self):
+        needle = Needle(b"ab")
+        assert compile_needle(needle) is needle
+        assert compile_needle(b"ab") is compile_needle(b"ab")
+        assert bytes(compile_needle(bytearray(b"ab"))) == b"ab"
+
+
+class TestWriter(object):
+    def test_write_to(self, buf, tmpdir):
+        buf.add_bytes(b"abcd")
+        writer = Writer(buf.view())
+        assert len(writer) == 4
+        with tmpdir.join("t.txt").open("wb") as f:
+            res = writer.write_to(f.fileno())
+        assert res == 4
+        assert writer.done
+        assert tmpdir.join("t.txt").read("rb") == b"abcd"
+
+    def test_write_collator(self, buf, tmpdir):
+        buf.add_bytes(b"abc123")
+        collator = BufferCollator()
+        collator.append(buf.view(0, 2))
+        collator.append(buf.view(3, 6))
+        writer = Writer(collator)
+        assert len(writer) == 5
+        with tmpdir.join("t.txt").open("wb") as f:
+            res = writer.write_to(f.fileno())
+        assert res == 5
+        assert writer.done
+        assert tmpdir.join("t.txt").read("rb") == b"ab123"
+
+    def test_write_to_eagain(self):
+        data = Buffer.allocate(1024 * 1024)
+        data.add_bytes(b"a" * data.capacity)
+        writer = Writer(data.view())
+        r, w = os.pipe()
+        try:
+            fcntl.fcntl(w, fcntl.F_SETFL, os.O_NONBLOCK)
+            res = writer.write_to(w)
+            assert 0 < res < data.capacity
+            assert len(writer) == data.capacity - res
+            assert not writer.done
+            assert writer.write_to(w) == 0
+
+            received = len(os.read(r, res))
+            while not writer.done:
+                writer.write_to(w)
+                received += len(os.read(r, 65536))
+        finally:
+            os.close(r)
+            os.close(w)
+
+    def test_write_to_badfd(self, buf):
+        buf.add_bytes(b"abcd")
+        writer = Writer(buf.view())
+        with pytest.raises(OSError) as exc_info:
+            writer.write_to(-1)
+        assert exc_info.value.errno == errno.EBADF
+        assert len(writer) == 4
+
+    @pytest.mark.usefixtures("tracking")
+    def test_released_source(self, tmpdir):
+        b = Buffer.allocate(4)
+        b.add_bytes(b"abcd")
+        writer = Writer(b.view())
+        b.release()
+        assert len(writer) == 4
+        with tmpdir.join("t.txt").open("wb") as f:
+            with pytest.raises(ValueError):
+                writer.write_to(f.fileno())
+
+    @pytest.mark.usefixtures("tracking")
+    def test_released_while_writing(self):
+        data = Buffer.allocate(1024 * 1024)
+        data.add_bytes(b"a" * data.capacity)
+        writer = Writer(data.view())
+        r, w = os.pipe()
+        try:
+            fcntl.fcntl(w, fcntl.F_SETFL, os.O_NONBLOCK)
+            assert writer.write_to(w) > 0
+            data.release()
+            assert not writer.done
+            with pytest.raises(ValueError):
+                writer.write_to(w)
+        finally:
+            os.close(r)
+            os.close(w)
+
+
+class TestMatcher(object):
+    def test_scan(self):
+        b = Buffer.allocate(32)
+        b.add_bytes(b"ushers she said")
+        matcher = Matcher([b"he", b"she", b"his", b"hers"])
+        assert list(matcher.scan(b.view())) == [
+            (1, 1), (0, 2), (3, 2), (1, 7), (0, 8)
+        ]
+
+    def test_scan_no_matches(self, buf):
+        buf.add_bytes(b"abc")
+        matcher = Matcher([b"abcd", b"x"])
+        assert list(matcher.scan(buf.view())) == []
+
+    def test_scan_collator(self):
+        b1 = Buffer.allocate(8)
+        b1.add_bytes(b"xxhe")
+        b2 = Buffer.allocate(8)
+        b2.add_bytes(b"ll")
+        b3 = Buffer.allocate(8)
+        b3.add_bytes(b"o, hello")
+        collator = BufferCollator()
+        collator.append(b1.view())
+        collator.append(b2.view())
+        collator.append(b3.view())
+        matcher = Matcher([b"hello", b"lo"])
+        assert list(matcher.scan(collator)) == [
+            (0, 2), (1, 5), (0, 9), (1, 12)
+        ]
+        assert len(collator) == 14
+
+    def test_many_hits(self):
+        b = Buffer.allocate(4096)
+        b.add_bytes(b"a" * 4096)
+        matcher = Matcher([b"a", b"aa"])
+        hits = list(matcher.scan(b.view()))
+        assert len(hits) == 4096 + 4095
+        assert hits[:3] == [(0, 0), (1, 0), (0, 1)]
+
+    def test_duplicate_patterns(self, buf):
+        buf.add_bytes(b"xabx")
+        matcher = Matcher([b"ab", b"ab", b"b", b"ab"])
+        assert list(matcher.scan(buf.view())) == [
+            (0, 1), (1, 1), (3, 1), (2, 2)
+        ]
+
+    def test_empty_pattern(self):
+        with pytest.raises(ValueError):
+            Matcher([b"a", b""])
+
+    def test_len(self):
+        assert len(Matcher([b"a", b"bc"])) == 2
+
+
+class TestHTTPParser(object):
+    def test_parse(self):
+        b = Buffer.allocate(128)
+        b.add_bytes(
+            b"GET /index.html HTTP/1.1\r\n"
+            b"Host: example.com\r\n"
+            b"Accept:  */*  \r\n"
+            b"X-Foo: a\r\n"
+            b"x-foo: b\r\n"
+            b"\r\nbody"
+        )
+        parser = HTTPParser()
+        parser.feed(b)
+        request = parser.parse()
+        assert request.method == b"GET"
+        assert request.target == b"/index.html"
+        assert request.version == b"HTTP/1.1"
+        assert [(bytes(k), bytes(v)) for k, v in request.headers] == [
+            (b"Host", b"example.com"),
+            (b"Accept", b"*/*"),
+            (b"X-Foo", b"a"),
+            (b"x-foo", b"b"),
+        ]
+        assert request.get_header(b"HOST") == b"example.com"
+        assert request.get_header(b"missing") is None
+        assert request.get_headers(b"X-FOO") == [b"a", b"b"]
+        assert parser.parse() is None
+        assert parser.take() == b"body"
+        assert parser.take() == b""
+
+    def test_incremental(self):
+        parser = HTTPParser()
+        data = b"GET / HTTP/1.0\r\nHost: a\r\n\r\nGET /2 HTTP/1.0\r\n\r\n"
+        for i in range(0, len(data), 5):
+            b = Buffer.allocate(5)
+            b.add_bytes(data[i:i + 5])
+            parser.feed(b.view())
+            if i < 25:
+                assert parser.parse() is None
+        assert parser.parse().target == b"/"
+        assert parser.parse().target == b"/2"
+        assert parser.parse() is None
+
+    def test_collator(self):
+        b1 = Buffer.allocate(16)
+        b1.add_bytes(b"GET / HTTP/1.1\r\n")
+        b2 = Buffer.allocate(16)
+        b2.add_bytes(b"\r\n")
+        collator = BufferCollator()
+        collator.append(b1.view())
+        collator.append(b2.view())
+        parser = HTTPParser()
+        parser.feed(collator)
+        assert parser.parse().headers == []
+
+    def test_body_not_copied(self):
+        first = Buffer.allocate(16)
+        first.add_bytes(b"GET / HTTP/1.1\r\n")
+        second = Buffer.allocate(100 * 1024)
+        second.add_bytes(b"Host: a\r\n\r\n" + b"x" * 100000)
+        parser = HTTPParser()
+        parser.feed(first)
+        parser.feed(second)
+        request = parser.parse()
+        assert request.get_header(b"host") == b"a"
+        body = parser.take()
+        assert len(body) == 100000
+        assert body._keepalive is second
+        assert parser.take() == b""
+
+    def test_same_buffer_fed_again(self):
+        b = Buffer.allocate(64)
+        b.add_bytes(b"GET / HTTP/1.1\r\nHo")
+        parser = HTTPParser()
+        parser.feed(b)
+        assert parser.parse() is None
+        b.add_bytes(b"st: a\r\n\r\nbody")
+        parser.feed(b)
+        request = parser.parse()
+        assert request.get_header(b"host") == b"a"
+        parser.feed(b)
+        assert parser.take() == b"body"
+
+    @pytest.mark.parametrize("data", [
+        b"GET / HTTP/1.1\r\nHost: example.com\r\n",
+        b"GET / HTTP/1.1\r\nHost: example.com\r\n\r\n",
+    ])
+    def test_too_large(self, data):
+        b = Buffer.allocate(64)
+        b.add_bytes(data)
+        parser = HTTPParser(max_head_size=16)
+        parser.feed(b.view())
+        with pytest.raises(HTTPParseError):
+            parser.parse()
+
+    @pytest.mark.parametrize("head", [
+        b"GET /\r\n\r\n",
+        b"GET / FTP/1.0\r\n\r\n",
+        b"GET / HTTP/1.1\r\nHost\r\n\r\n",
+        b"GET / HTTP/1.1\r\nHost : a\r\n\r\n",
+        b"GET / HTTP/1.1\r\nHost: a\r\n  folded\r\n\r\n",
+        b"GET / HTTP/1.1\r\n: a\r\n\r\n",
+    ])
+    def test_invalid(self, head):
+        b = Buffer.allocate(64)
+        b.add_bytes(head)
+        parser = HTTPParser()
+        parser.feed(b.view())
+        with pytest.raises(HTTPParseError):
+            parser.parse()
+
+
+def _varint(n):
+    result = []
+    while True:
+        c = n & 0x7f
+        n >>= 7
+        if n:
+            result.append(c | 0x80)
+        else:
+            result.append(c)
+            return bytes(bytearray(result))
+
+
+class TestFrameReader(object):
+    FRAMES = [b"abc", b"", b"x" * 40, b"hello world"]
+
+    def read_frames(self, tmpdir, data, **kwargs):
+        t = tmpdir.join("t.bin")
+        t.write(data, "wb")
+        with t.open("rb") as f:
+            reader = FrameReader(f.fileno(), **kwargs)
+            return [bytes(frame) for frame in reader]
+
+    @pytest.mark.parametrize("prefix", [">I", "<I", ">H", "B", "<Q"])
+    def test_fixed_prefix(self, tmpdir, prefix):
+        data = b"".join(
+            struct.pack(prefix, len(frame)) + frame for frame in self.FRAMES
+        )
+        assert self.read_frames(tmpdir, data, prefix=prefix) == self.FRAMES
+        assert self.read_frames(
+            tmpdir, data, prefix=prefix, buffer_size=16
+        ) == self.FRAMES
+
+    def test_varint_prefix(self, tmpdir):
+        frames = self.FRAMES + [b"y" * 300]
+        data = b"".join(_varint(len(frame)) + frame for frame in frames)
+        assert self.read_frames(tmpdir, data, prefix="varint") == frames
+        assert self.read_frames(
+            tmpdir, data, prefix="varint", buffer_size=16
+        ) == frames
+
+    def test_frames_share_buffer(self, tmpdir):
+        t = tmpdir.join("t.bin")
+        t.write(b"\x01a\x01b", "wb")
+        with t.open("rb") as f:
+            a, b = FrameReader(f.fileno(), prefix="B")
+        assert a._keepalive is b._keepalive
+
+    def test_truncated(self, tmpdir):
+        with pytest.raises(EOFError):
+            self.read_frames(tmpdir, b"\x00\x05abc")
+        with pytest.raises(EOFError):
+            self.read_frames(tmpdir, b"\x00\x00")
+
+    def test_varint_too_long(self, tmpdir):
+        with pytest.raises(ValueError):
+            self.read_frames(tmpdir, b"\xff" * 11, prefix="varint")
+
+    def test_max_frame_size(self, tmpdir):
+        with pytest.raises(ValueError):
+            self.read_frames(
+                tmpdir, b"\x00\x00\x00\x05abcde", max_frame_size=4
+            )
+
+
+class TestParallel(object):
+    @pytest.fixture(autouse=True)
+    def small_chunks(self, monkeypatch):
+        monkeypatch.setattr(zero_buffer, "PARALLEL_MIN_CHUNK_SIZE", 1)
+
+    @pytest.mark.parametrize("workers", [1, 2, 3, 7, 64])
+    @pytest.mark.parametrize(("data", "sep"), [
+        (b"abc\ndef\n\nghi\n", b"\n"),
+        (b"a\r\n\r\n\r\nb\r\n\r\nc\r\n\r\n\r\n\r\nd", b"\r\n\r\n"),
+        (b"aaaaaaa", b"aa"),
+        (b"no separators", b"::"),
+        (b"", b"\n"),
+    ])
+    def test_split_count(self, data, sep, workers):
+        b = Buffer.allocate(64)
+        b.add_bytes(data)
+        view = b.view()
+        assert list(parallel_split(view, sep, workers)) == data.split(sep)
+        assert parallel_count(view, sep, workers) == data.count(sep)
+
+    def test_default_workers(self, buf):
+        buf.add_bytes(b"a-b-c")
+        assert parallel_count(buf.view(), b"-") == 2
+        assert list(parallel_split(buf.view(), b"-")) == [b"a", b"b", b"c"]
+
+    def test_many_matches(self):
+        # More matches per chunk than the first offsets array holds.
+        data = b"ab," * 1000
+        b = Buffer.allocate(len(data))
+        b.add_bytes(data)
+        assert list(parallel_split(b.view(), b",", 3)) == data.split(b",")
+
+    def test_empty_separator(self, buf):
+        with pytest.raises(ValueError):
+            parallel_split(buf.view(), b"")
+        with pytest.raises(ValueError):
+            parallel_count(buf.view(), b"")
+
+
+def _shared_view_bytes(view):
+    return bytes(view), view._keepalive.writepos
+
+
+def _unpickle_shared_view(data):
+    return bytes(pickle.loads(data))
+
+
+@pytest.mark.skipif(
+    sys.version_info < (3, 8), reason="Requires multiprocessing.shared_memory"
+)
+class TestSharedBuffer(object):
+    def test_allocate_shared(self):
+        b = Buffer.allocate_shared(16)
+        assert b.capacity == 16
+        assert b.writepos == 0
+        b.add_bytes(b"abc")
+        assert b.view() == b"abc"
+
+    def test_pickle(self):
+        b = Buffer.allocate_shared(16)
+        b.add_bytes(b"abc123")
+        view = pickle.loads(pickle.dumps(b.view(2, 5)))
+        assert view == b"c12"
+        assert view._keepalive is b
+
+    def test_pickle_unshared(self, buf):
+        with pytest.raises(TypeError):
+            pickle.dumps(buf.view())
+
+    def test_other_process(self):
+        b = Buffer.allocate_shared(16)
+        b.add_bytes(b"abc123")
+        ctx = multiprocessing.get_context("spawn")
+        pool = ctx.Pool(1)
+        try:
+            data, writepos = pool.apply(_shared_view_bytes, (b.view(1, 4),))
+        finally:
+            pool.close()
+            pool.join()
+        assert data == b"bc1"
+        assert writepos == 16
+
+    @pytest.mark.skipif(
+        not os.path.isdir("/dev/shm"), reason="Requires /dev/shm"
+    )
+    def test_dropped_before_unpickled(self):
+        b = Buffer.allocate_shared(16)
+        b.add_bytes(b"abc123")
+        path = os.path.join("/dev/shm", b.name)
+        data = pickle.dumps(b.view(1, 4))
+        del b
+        gc.collect()
+        assert os.path.exists(path)
+        ctx = multiprocessing.get_context("spawn")
+        pool = ctx.Pool(1)
+        try:
+            assert pool.apply(_unpickle_shared_view, (data,)) == b"bc1"
+        finally:
+            pool.close()
+            pool.join()
+        # The child process dropped the last reference.
+        assert not os.path.exists(path)
+
+    def test_pickle_released(self):
+        b = Buffer.allocate_shared(16)
+        view = b.view()
+        b.release()
+        with pytest.raises(ValueError):
+            pickle.dumps(view)
+
+    @pytest.mark.skipif(
+        not os.path.isdir("/dev/shm"), reason="Requires /dev/shm"
+    )
+    def test_unpickled_after_release(self):
+        b = Buffer.allocate_shared(16)
+        b.add_bytes(b"abc123")
+        path = os.path.join("/dev/shm", b.name)
+        data = pickle.dumps(b.view(1, 4))
+        b.release()
+        view = pickle.loads(data)
+        assert view == b"bc1"
+        assert view._keepalive is not b
+        del b, view
+        gc.collect()
+        assert not os.path.exists(path)
+
+    @pytest.mark.skipif(
+        not os.path.isdir("/dev/shm"), reason="Requires /dev/shm"
+    )
+    @pytest.mark.usefixtures("tracking")
+    def test_unlinked_when_released(self):
+        b = Buffer.allocate_shared(16)
+        path = os.path.join("/dev/shm", b.name)
+        view = b.view()
+        b.release()
+        gc.collect()
+        assert not os.path.exists(path)
+        assert view == b""
+
+    @pytest.mark.skipif(
+        not os.path.isdir("/dev/shm"), reason="Requires /dev/shm"
+    )
+    def test_unlinked_when_collected(self):
+        b = Buffer.allocate_shared(16)
+        path = os.path.join("/dev/shm", b.name)
+        view = b.view()
+        del b
+        gc.collect()
+        assert os.path.exists(path)
+        del view
+        gc.collect()
+        assert not os.path.exists(path)
+
+
+class TestCodecs(object):
+    @pytest.fixture(params=["zlib", "gzip", "deflate", "zstd", "lz4"])
+    def codec(self, request):
+        if request.param == "zstd":
+            pytest.importorskip("zstandard")
+        elif request.param == "lz4":
+            pytest.importorskip("lz4.frame")
+        return request.param
+
+    def roundtrip(self, codec, views, buffer_size=8192):
+        compressor = Compressor(codec, buffer_size=buffer_size)
+        compressed = []
+        for view in views:
+            compressed.extend(compressor.feed(view))
+        compressed.extend(compressor.flush())
+
+        decompressor = Decompressor(codec, buffer_size=buffer_size)
+        result = []
+        for view in compressed:
+            result.extend(decompressor.feed(view))
+        result.extend(decompressor.flush())
+        assert all(isinstance(view, BufferView) for view in result)
+        return b"".join(bytes(view) for view in result)
+
+    def test_roundtrip(self, codec):
+        b = Buffer.allocate(1024)
+        for i in range(64):
+            b.add_bytes(("line %d\n" % i).encode("ascii"))
+        views = [b.view(0, 100), b.view(100, 200), b.view(200)]
+        assert self.roundtrip(codec, views) == bytes(b.view())
+        assert self.roundtrip(codec, views, buffer_size=16) == bytes(b.view())
+
+    def test_collator(self, codec):
+        b = Buffer.allocate(16)
+        b.add_bytes(b"abc123")
+        collator = BufferCollator()
+        collator.append(b.view(0, 2))
+        collator.append(b.view(3, 6))
+        assert self.roundtrip(codec, [collator]) == b"ab123"
+
+    def test_zlib_compatible(self, buf):
+        buf.add_bytes(zlib.compress(b"abc"))
+        decompressor = Decompressor()
+        assert [bytes(v) for v in decompressor.feed(buf.view())] == [b"abc"]
+
+    def test_shared_output_buffer(self):
+        c = zlib.compressobj()
+        first = c.compress(b"abc") + c.flush(zlib.Z_SYNC_FLUSH)
+        second = c.compress(b"def") + c.flush()
+        b = Buffer.allocate(64)
+        b.add_bytes(first + second)
+        decompressor = Decompressor(buffer_size=64)
+        [abc] = decompressor.feed(b.view(0, len(first)))
+        [def_] = decompressor.feed(b.view(len(first)))
+        assert abc == b"abc"
+        assert def_ == b"def"
+        assert abc._keepalive is def_._keepalive
+
+    def test_unknown_codec(self):
+        with pytest.raises(ValueError):
+            Compressor("rot13")
+        with pytest.raises(ValueError):
+            Decompressor("rot13")
+
+
+class TestReadMany(object):
+    def test_read_many(self, tmpdir):
+        r1, w1 = os.pipe()
+        r2, w2 = os.pipe()
+        r3, w3 = os.pipe()
+        t = tmpdir.join("t.txt")
+        t.write("")
+        full = Buffer.allocate(1)
+        full.add_bytes(b"x")
+        bufs = [Buffer.allocate(16) for _ in range(4)]
+        try:
+            os.write(w1, b"abc")
+            os.write(w3, b"123456")
+            os.close(w2)
+            with t.open() as f:
+                results = read_many([
+                    (r1, bufs[0]),
+                    (r2, bufs[1]),
+                    (r3, bufs[2]),
+                    (f.fileno(), bufs[3]),
+                    (r1, full),
+                ], timeout=1)
+            assert results[0] == 3
+            assert bufs[0].view() == b"abc"
+            assert isinstance(results[1], EOFError)
+            assert results[2] == 6
+            assert bufs[2].view() == b"123456"
+            assert isinstance(results[3], EOFError)
+            assert isinstance(results[4], BufferFull)
+        finally:
+            for fd in [r1, w1, r2, r3, w3]:
+                os.close(fd)
+
+    def test_not_ready(self, buf):
+        r, w = os.pipe()
+        try:
+            assert read_many([(r, buf)], timeout=0) == [None]
+            assert buf.writepos == 0
+        finally:
+            os.close(r)
+            os.close(w)
+
+    def test_errors(self, buf):
+        [result] = read_many([(-1, buf)])
+        assert isinstance(result, OSError)
+        assert result.errno == errno.EBADF
+        r, w = os.pipe()
+        os.close(r)
+        os.close(w)
+        [result] = read_many([(r, buf)], timeout=0)
+        assert isinstance(result, OSError)
+        assert result.errno == errno.EBADF
+
+    def test_empty(self):
+        assert read_many([]) == []
+
+
+class TestCSVReader(object):
+    DATA = (
+        b'a,b,c\r\n"x,""y""",,""\n\n"multi\nline",2\r3,4\r\n' +
+        b",".join(str(i).encode("ascii") for i in range(100)) + b"\n" +
+        b'"",\n"end"'
+    )
+
+    def expected(self, data):
+        reader = csv.reader(io.StringIO(data.decode("ascii"), newline=""))
+        return [[field.encode("ascii") for field in row] for row in reader]
+
+    def read(self, data, chunk_size, **kwargs):
+        reader = CSVReader(**kwargs)
+        rows = []
+        for i in range(0, len(data), chunk_size):
+            b = Buffer.allocate(chunk_size)
+            b.add_bytes(data[i:i + chunk_size])
+            rows.extend(reader.feed(b.view()))
+        rows.extend(reader.close())
+        for row in rows:
+            assert all(isinstance(field, BufferView) for field in row)
+        return [[bytes(field) for field in row] for row in rows]
+
+    @pytest.mark.parametrize("chunk_size", [1, 2, 3, 7, 64, 1024])
+    def test_matches_csv_module(self, chunk_size):
+        assert self.read(self.DATA, chunk_size) == self.expected(self.DATA)
+
+    def test_fields_are_views(self, buf):
+        buf.add_bytes(b'a,"b"\n')
+        reader = CSVReader()
+        [[a, b]] = reader.feed(buf.view())
+        assert a._keepalive is buf
+        assert b._keepalive is buf
+        assert reader.close() == []
+
+    def test_incomplete_rows_kept(self, buf):
+        buf.add_bytes(b'a,b\nc,"d')
+        reader = CSVReader()
+        assert reader.feed(buf.view()) == [[b"a", b"b"]]
+        b = Buffer.allocate(8)
+        b.add_bytes(b'\n"\r')
+        assert reader.feed(b.view()) == []
+        assert reader.close() == [[b"c", b"d\n"]]
+
+    def test_only_straddling_row_copied(self, buf):
+        buf.add_bytes(b"a,b\nc,d")
+        second = Buffer.allocate(4096)
+        second.add_bytes(b'd,"e\n"\r\n' + b"f,g\n" * 100)
+        reader = CSVReader()
+        assert reader.feed(buf.view()) == [[b"a", b"b"]]
+        rows = reader.feed(second.view())
+        assert rows[0] == [b"c", b"dd", b"e\n"]
+        assert rows[0][0]._keepalive is not second
+        assert len(rows) == 101
+        for row in rows[1:]:
+            assert row == [b"f", b"g"]
+            assert all(field._keepalive is second for field in row)
+
+    def test_delimiter(self):
+        data = b'a\tb\t"c\td"\n'
+        assert self.read(data, 4, delimiter=b"\t", quotechar=b"'") == [
+            [b"a", b"b", b'"c', b'd"']
+        ]
+
+    def test_collator(self, buf):
+        buf.add_bytes(b"a,b\nc,d")
+        collator = BufferCollator()
+        collator.append(buf.view(0, 3))
+        collator.append(buf.view(3))
+        reader = CSVReader()
+        assert reader.feed(collator) == [[b"a", b"b"]]
+        assert reader.close() == [[b"c", b"d"]]
+
+    @pytest.mark.parametrize("data", [b'"a"b,c\n', b'a,"b\n'])
+    def test_invalid(self, buf, data):
+        buf.add_bytes(data)
+        reader = CSVReader()
+        with pytest.raises(CSVParseError):
+            reader.feed(buf.view())
+            reader.close()
+
+    def test_invalid_arguments(self):
+        with pytest.raises(ValueError):
+            CSVReader(delimiter=b",,")
+        with pytest.raises(ValueError):
+            CSVReader(quotechar=b"")
+
+
+class TestHooks(object):
+    def test_hook(self, buf):
+        events = []
+
+        def hook(op, nbytes, duration):
+            events.append((op, nbytes))
+            assert duration >= 0
+
+        r, w = os.pipe()
+        add_hook(hook)
+        try:
+            buf.add_bytes(b"abc")
+            buf.view().write_to(w)
+            Writer(buf.view(1)).write_to(w)
+            os.close(w)
+            b = Buffer.allocate(8)
+            b.read_from(r)
+            with pytest.raises(EOFError):
+                b.read_from(r)
+            collator = BufferCollator()
+            collator.append(buf.view())
+            collator.append(b.view())
+            collator.collapse()
+        finally:
+            remove_hook(hook)
+            os.close(r)
+        with open(os.devnull, "wb") as f:
+            buf.view().write_all(f.fileno())
+        assert events == [
+            ("write_to", 3), ("write_to", 2), ("read_from", 5),
+            ("read_from", 0), ("collapse", 8),
+        ]
+
+    def test_profiler(self, buf):
+        buf.add_bytes(b"abc")
+        collator = BufferCollator()
+        with Profiler() as profiler:
+            for _ in range(3):
+                collator.append(buf.view())
+                collator.collapse()
+        collator.append(buf.view())
+        collator.collapse()
+        result = profiler.as_dict()
+        assert list(result) == ["collapse"]
+        assert result["collapse"]["total"]["count"] == 3
+        assert list(result["collapse"]["sizes"]) == [4]
+        assert profiler.histogram("collapse", 4).count == 3
+        assert profiler.histogram("read_from") is None
+
+    def test_histogram(self):
+        histogram = LatencyHistogram()
+        assert histogram.percentile(50) is None
+        for i in range(1, 1001):
+            histogram.record(i * 1e-6)
+        assert histogram.count == 1000
+        assert histogram.min == 1e-6
+        assert histogram.max == 1000e-6
+        for p in [50, 90, 99]:
+            assert histogram.percentile(p) == pytest.approx(p * 1e-5, rel=0.05)
+        assert histogram.percentile(100) == 1000e-6
+        result = histogram.as_dict()
+        assert result["count"] == 1000
+        assert result["mean"] == pytest.approx(500.5e-6)
+        assert sum(count for _, count in result["buckets"]) == 1000
+
+
+binary = st.binary(max_size=32) | st.lists(
+    st.sampled_from([b"a", b"b", b" ", b"\t", b"\r", b"\n", b"\x0b", b"\x1c"]),
+    max_size=32
+).map(b"".join)
+needles = st.binary(max_size=3) | st.lists(
+    st.sampled_from([b"a", b"b", b"\r", b"\n"]), max_size=4
+).map(b"".join)
+indices = st.none() | st.integers(-40, 40)
+
+
+def make_view(data):
+    # Surround the view with bytes that the needles use, so that reading
+    # outside of it changes the results.
+    b = Buffer.allocate(len(data) + 4)
+    b.add_bytes(b"ab" + data + b"ab")
+    return b.view(2, 2 + len(data))
+
+
+@pytest.mark.usefixtures("backend")
+class TestBytesEquivalence(object):
+    @given(binary, needles, indices, indices)
+    def test_find(self, data, needle, start, stop):
+        view = make_view(data)
+        args = (start or 0, stop)
+        assert view.find(needle, *args) == data.find(needle, *args)
+        assert view.rfind(needle, *args) == data.rfind(needle, *args)
+        assert view.find(Needle(needle), *args) == data.find(needle, *args)
+        assert view.find(needle.upper(), *args, ignore_case=True) == (
+            data.lower().find(needle.lower(), *args)
+        )
+        assert (needle in view) == (needle in data)
+
+    @given(binary, needles, indices, indices)
+    def test_index(self, data, needle, start, stop):
+        view = make_view(data)
+        args = (start or 0, stop)
+        try:
+            expected = data.index(needle, *args)
+        except ValueError:
+            with pytest.raises(ValueError):
+                view.index(needle, *args)
+        else:
+            assert view.index(needle, *args) == expected
+        try:
+            expected = data.rindex(needle, *args)
+        except ValueError:
+            with pytest.raises(ValueError):
+                view.rindex(needle, *args)
+        else:
+            assert view.rindex(needle, *args) == expected
+
+    @given(binary, needles.filter(bool), st.integers(-1, 3))
+    def test_split(self, data, sep, maxsplit):
+        view = make_view(data)
+        assert [bytes(part) for part in view.split(sep, maxsplit)] == (
+            data.split(sep, maxsplit)
+        )
+
+    @given(binary, st.booleans())
+    def test_splitlines(self, data, keepends):
+        view = make_view(data)
+        assert [bytes(line) for line in view.splitlines(keepends)] == (
+            data.splitlines(keepends)
+        )
+
+    @given(binary, st.none() | needles)
+    def test_strip(self, data, chars):
+        view = make_view(data)
+        assert bytes(view.strip(chars)) == data.strip(chars)
+        assert bytes(view.lstrip(chars)) == data.lstrip(chars)
+        assert bytes(view.rstrip(chars)) == data.rstrip(chars)
+
+    @given(binary | st.text("0123456789", max_size=4).map(
+        lambda s: s.encode("ascii")
+    ))
+    def test_classification(self, data):
+        view = make_view(data)
+        assert view.isspace() == data.isspace()
+        assert view.isdigit() == data.isdigit()
+        assert view.isalpha() == data.isalpha()
+
+    @given(binary, binary)
+    def test_eq(self, data, other):
+        view = make_view(data)
+        assert (view == other) == (data == other)
+        assert (view != other) == (data != other)
+        assert (view == make_view(other)) == (data == other)
+        assert view.equals_ignore_case(other.upper()) == (
+            data.lower() == other.lower()
+        )
+
+    @given(binary, indices, indices)
+    def test_getitem(self, data, start, stop):
+        view = make_view(data)
+        start, stop, _ = slice(start, stop).indices(len(data))
+        if start <= stop:
+            assert bytes(view[start:stop]) == data[start:stop]
+        for idx in [start, stop, -1]:
+            if -len(data) <= idx < len(data):
+                assert view[idx] == bytearray(data)[idx]
+            else:
+                with pytest.raises(IndexError):
+                    view[idx]
@@ -1,4 +1,19 @@
+import atexit
+import bisect
+import collections
+import errno
+import hashlib
+import io
+import math
+import multiprocessing
 import os
+import platform
+import struct
+import threading
+import time
+import weakref
+import zlib
+from multiprocessing.pool import ThreadPool
 
 import six
 from six.moves import xrange
@@ -15,8 +30,41 @@ int memcmp(const void *, const void *, size_t);
 void *memchr(const void *, int, size_t);
 void *Zero_memrchr(const void *, int, size_t);
 void *memcpy(void *, const void *, size_t);
+
+int Zero_write_all(int, const uint8_t *, size_t, size_t *);
+size_t Zero_ac_scan(const int32_t *, const int32_t *, const int32_t *, size_t,
+                    int32_t *, const uint8_t *, size_t, size_t *,
+                    int32_t *, size_t *, size_t);
+int Zero_ascii_casecmp(const void *, const void *, size_t);
+size_t Zero_find_all(const uint8_t *, size_t, const void *, size_t,
+                     size_t *, size_t);
+uint64_t Zero_fnv1a(const uint8_t *, size_t, uint64_t);
+ssize_t Zero_find(const uint8_t *, size_t, const void *, size_t);
+ssize_t Zero_rfind(const uint8_t *, size_t, const void *, size_t);
+size_t Zero_span(const uint8_t *, size_t, const uint8_t *);
+size_t Zero_rspan(const uint8_t *, size_t, const uint8_t *);
+size_t Zero_find_eol(const uint8_t *, size_t);
+ssize_t Zero_find_ignore_case(const uint8_t *, size_t, const void *, size_t);
+void Zero_ascii_translate(uint8_t *, const uint8_t *, size_t, int);
+int Zero_is_ascii(const uint8_t *, size_t);
+int64_t Zero_atomic_add(int64_t *, int64_t);
+int Zero_is_valid_utf8(const uint8_t *, size_t);
+int Zero_read_many(size_t, const int *, uint8_t **, const size_t *, int,
+                   ssize_t *, int *);
+ssize_t Zero_csv_scan(const uint8_t *, size_t, uint8_t, uint8_t, int, int,
+                      size_t *, size_t *, uint8_t *, size_t, size_t *);
+#define ZERO_CSV_ESCAPED ...
+#define ZERO_CSV_ROW_END ...
+#define ZERO_CSV_QUOTED ...
+#define ZERO_CSV_INCOMPLETE ...
+#define ZERO_CSV_INVALID ...
+#define ZERO_CSV_TOO_MANY_FIELDS ...
 """)
 _lib = _ffi.verify("""
+#include <errno.h>
+#include <poll.h>
+#include <stdint.h>
+#include <stdlib.h>
 #include <string.h>
 #include <sys/types.h>
 #include <sys/uio.h>
@@ -38,30 +86,640 @@ void *Zero_memrchr(const void *s, int c, size_t n) {
     return NULL;
 }
 #endif
+
+int Zero_write_all(int fd, const uint8_t *data, size_t n, size_t *written) {
+    ssize_t res;
+    *written = 0;
+    while (*written < n) {
+        res = write(fd, data + *written, n - *written);
+        if (res == -1) {
+            if (errno == EINTR) {
+                continue;
+            }
+            return errno;
+        }
+        *written += res;
+    }
+    return 0;
+}
+
+size_t Zero_ac_scan(const int32_t *delta, const int32_t *output,
+                    const int32_t *dict_link, size_t npatterns,
+                    int32_t *state, const uint8_t *data, size_t n, size_t *pos,
+                    int32_t *hit_patterns, size_t *hit_ends, size_t max_hits) {
+    size_t nhits = 0;
+    size_t i = *pos;
+    int32_t s = *state;
+    int32_t t;
+    /* A single position can match at most every pattern, so only advance
+       while there is room left to record all of them. */
+    while (i < n && max_hits - nhits >= npatterns) {
+        s = delta[s * 256 + data[i]];
+        i++;
+        t = output[s] >= 0 ? s : dict_link[s];
+        while (t >= 0) {
+            hit_patterns[nhits] = output[t];
+            hit_ends[nhits] = i;
+            nhits++;
+            t = dict_link[t];
+        }
+    }
+    *state = s;
+    *pos = i;
+    return nhits;
+}
+
+static inline uint8_t Zero_ascii_lower(uint8_t c) {
+    return (c >= 'A' && c <= 'Z') ? c + ('a' - 'A') : c;
+}
+
+size_t Zero_find_all(const uint8_t *data, size_t n, const void *needle,
+                     size_t m, size_t *out, size_t max_out) {
+    const uint8_t *nd = needle;
+    const uint8_t *p;
+    size_t i = 0;
+    size_t count = 0;
+    while (m <= n && i <= n - m) {
+        p = memchr(data + i, nd[0], n - m - i + 1);
+        if (p == NULL) {
+            break;
+        }
+        i = p - data;
+        if (memcmp(p + 1, nd + 1, m - 1) == 0) {
+            if (out != NULL) {
+                if (count == max_out) {
+                    break;
+                }
+                out[count] = i;
+            }
+            count++;
+            i += m;
+        } else {
+            i++;
+        }
+    }
+    return count;
+}
+
+ssize_t Zero_find(const uint8_t *data, size_t n, const void *needle,
+                  size_t m) {
+    const uint8_t *nd = needle;
+    const uint8_t *p;
+    size_t i = 0;
+    while (m <= n && i <= n - m) {
+        p = memchr(data + i, nd[0], n - m - i + 1);
+        if (p == NULL) {
+            break;
+        }
+        if (memcmp(p + 1, nd + 1, m - 1) == 0) {
+            return p - data;
+        }
+        i = p - data + 1;
+    }
+    return -1;
+}
+
+ssize_t Zero_rfind(const uint8_t *data, size_t n, const void *needle,
+                   size_t m) {
+    const uint8_t *nd = needle;
+    const uint8_t *p;
+    /* The number of positions a match could still start at. */
+    size_t k = m <= n ? n - m + 1 : 0;
+    while (k > 0) {
+        p = Zero_memrchr(data, nd[0], k);
+        if (p == NULL) {
+            break;
+        }
+        if (memcmp(p + 1, nd + 1, m - 1) == 0) {
+            return p - data;
+        }
+        k = p - data;
+    }
+    return -1;
+}
+
+/* The length of the prefix of data made up of bytes set in table. */
+size_t Zero_span(const uint8_t *data, size_t n, const uint8_t *table) {
+    size_t i = 0;
+    while (i < n && table[data[i]]) {
+        i++;
+    }
+    return i;
+}
+
+/* The length of the suffix of data made up of bytes set in table. */
+size_t Zero_rspan(const uint8_t *data, size_t n, const uint8_t *table) {
+    size_t i = n;
+    while (i > 0 && table[data[i - 1]]) {
+        i--;
+    }
+    return n - i;
+}
+
+size_t Zero_find_eol(const uint8_t *data, size_t n) {
+    size_t i = 0;
+    while (i < n && data[i] != '\\n' && data[i] != '\\r') {
+        i++;
+    }
+    return i;
+}
+
+uint64_t Zero_fnv1a(const uint8_t *data, size_t n, uint64_t h) {
+    size_t i;
+    for (i = 0; i < n; i++) {
+        h ^= data[i];
+        h *= 1099511628211ULL;
+    }
+    return h;
+}
+
+int Zero_ascii_casecmp(const void *a, const void *b, size_t n) {
+    const uint8_t *x = a, *y = b;
+    size_t i;
+    for (i = 0; i < n; i++) {
+        if (Zero_ascii_lower(x[i]) != Zero_ascii_lower(y[i])) {
+            return 1;
+        }
+    }
+    return 0;
+}
+
+ssize_t Zero_find_ignore_case(const uint8_t *data, size_t n,
+                              const void *needle, size_t m) {
+    const uint8_t *nd = needle;
+    uint8_t first = Zero_ascii_lower(nd[0]);
+    size_t i;
+    for (i = 0; m <= n && i <= n - m; i++) {
+        if (
+            Zero_ascii_lower(data[i]) == first &&
+            Zero_ascii_casecmp(data + i + 1, nd + 1, m - 1) == 0
+        ) {
+            return i;
+        }
+    }
+    return -1;
+}
+
+void Zero_ascii_translate(uint8_t *dst, const uint8_t *src, size_t n,
+                          int upper) {
+    size_t i;
+    if (upper) {
+        for (i = 0; i < n; i++) {
+            dst[i] = (src[i] >= 'a' && src[i] <= 'z') ? src[i] - 32 : src[i];
+        }
+    } else {
+        for (i = 0; i < n; i++) {
+            dst[i] = Zero_ascii_lower(src[i]);
+        }
+    }
+}
+
+#define ZERO_HIGH_BITS 0x8080808080808080ULL
+
+int64_t Zero_atomic_add(int64_t *p, int64_t n) {
+    return __sync_add_and_fetch(p, n);
+}
+
+int Zero_is_ascii(const uint8_t *data, size_t n) {
+    size_t i = 0;
+    uint64_t word;
+    for (; n - i >= 8; i += 8) {
+        memcpy(&word, data + i, 8);
+        if (word & ZERO_HIGH_BITS) {
+            return 0;
+        }
+    }
+    for (; i < n; i++) {
+        if (data[i] & 0x80) {
+            return 0;
+        }
+    }
+    return 1;
+}
+
+#define ZERO_IS_CONT(c) (((c) & 0xC0) == 0x80)
+
+int Zero_is_valid_utf8(const uint8_t *data, size_t n) {
+    size_t i = 0;
+    uint64_t word;
+    uint8_t c;
+    while (i < n) {
+        c = data[i];
+        if (c < 0x80) {
+            if (n - i >= 8) {
+                memcpy(&word, data + i, 8);
+                if (!(word & ZERO_HIGH_BITS)) {
+                    i += 8;
+                    continue;
+                }
+            }
+            i++;
+        } else if (c >= 0xC2 && c <= 0xDF) {
+            if (n - i < 2 || !ZERO_IS_CONT(data[i + 1])) {
+                return 0;
+            }
+            i += 2;
+        } else if (c >= 0xE0 && c <= 0xEF) {
+            if (
+                n - i < 3 ||
+                !ZERO_IS_CONT(data[i + 1]) || !ZERO_IS_CONT(data[i + 2]) ||
+                /* Overlong encodings */
+                (c == 0xE0 && data[i + 1] < 0xA0) ||
+                /* UTF-16 surrogates */
+                (c == 0xED && data[i + 1] > 0x9F)
+            ) {
+                return 0;
+            }
+            i += 3;
+        } else if (c >= 0xF0 && c <= 0xF4) {
+            if (
+                n - i < 4 ||
+                !ZERO_IS_CONT(data[i + 1]) || !ZERO_IS_CONT(data[i + 2]) ||
+                !ZERO_IS_CONT(data[i + 3]) ||
+                /* Overlong encodings */
+                (c == 0xF0 && data[i + 1] < 0x90) ||
+                /* Past U+10FFFF */
+                (c == 0xF4 && data[i + 1] > 0x8F)
+            ) {
+                return 0;
+            }
+            i += 4;
+        } else {
+            return 0;
+        }
+    }
+    return 1;
+}
+
+int Zero_read_many(size_t n, const int *fds, uint8_t **bufs,
+                   const size_t *sizes, int timeout, ssize_t *results,
+                   int *errors) {
+    struct pollfd *pfds;
+    size_t i;
+    int res;
+    pfds = calloc(n, sizeof(struct pollfd));
+    if (pfds == NULL) {
+        return ENOMEM;
+    }
+    for (i = 0; i < n; i++) {
+        pfds[i].fd = fds[i];
+        pfds[i].events = POLLIN;
+    }
+    do {
+        res = poll(pfds, n, timeout);
+    } while (res == -1 && errno == EINTR);
+    if (res == -1) {
+        res = errno;
+        free(pfds);
+        return res;
+    }
+    for (i = 0; i < n; i++) {
+        errors[i] = 0;
+        if (pfds[i].revents & POLLNVAL) {
+            results[i] = -1;
+            errors[i] = EBADF;
+        } else if (pfds[i].revents) {
+            do {
+                results[i] = read(fds[i], bufs[i], sizes[i]);
+            } while (results[i] == -1 && errno == EINTR);
+            if (results[i] == -1) {
+                errors[i] = errno;
+            }
+        } else {
+            /* Not ready. */
+            results[i] = -2;
+        }
+    }
+    free(pfds);
+    return 0;
+}
+
+#define ZERO_CSV_ESCAPED 1
+#define ZERO_CSV_ROW_END 2
+#define ZERO_CSV_QUOTED 4
+#define ZERO_CSV_INCOMPLETE -1
+#define ZERO_CSV_INVALID -2
+#define ZERO_CSV_TOO_MANY_FIELDS -3
+
+/* Scans one row starting at data[i], recording its fields. Returns the
+   position after the row, or one of the negative ZERO_CSV_ codes. */
+static ssize_t Zero_csv_row(const uint8_t *data, size_t n, size_t i,
+                            uint8_t delim, uint8_t quote, int final,
+                            size_t *starts, size_t *ends, uint8_t *flags,
+                            size_t max_fields, size_t *count) {
+    const uint8_t *q;
+    uint8_t c;
+    for (;;) {
+        if (*count == max_fields) {
+            return ZERO_CSV_TOO_MANY_FIELDS;
+        }
+        flags[*count] = 0;
+        if (i < n && data[i] == quote) {
+            flags[*count] = ZERO_CSV_QUOTED;
+            starts[*count] = ++i;
+            for (;;) {
+                q = memchr(data + i, quote, n - i);
+                if (q == NULL) {
+                    return final ? ZERO_CSV_INVALID : ZERO_CSV_INCOMPLETE;
+                }
+                i = q - data + 1;
+                if (i == n && !final) {
+                    /* The next byte might be another quote. */
+                    return ZERO_CSV_INCOMPLETE;
+                } else if (i < n && data[i] == quote) {
+                    flags[*count] |= ZERO_CSV_ESCAPED;
+                    i++;
+                } else {
+                    break;
+                }
+            }
+            ends[*count] = i - 1;
+            if (i < n && data[i] != delim && data[i] != '\\r' &&
+                    data[i] != '\\n') {
+                return ZERO_CSV_INVALID;
+            }
+        } else {
+            starts[*count] = i;
+            while (
+                i < n && (c = data[i]) != delim && c != '\\r' && c != '\\n'
+            ) {
+                i++;
+            }
+            ends[*count] = i;
+        }
+        (*count)++;
+
+        if (i == n) {
+            if (!final) {
+                return ZERO_CSV_INCOMPLETE;
+            }
+            flags[*count - 1] |= ZERO_CSV_ROW_END;
+            return i;
+        }
+        c = data[i++];
+        if (c == delim) {
+            continue;
+        }
+        if (c == '\\r') {
+            if (i == n && !final) {
+                /* The next byte might be a '\\n'. */
+                return ZERO_CSV_INCOMPLETE;
+            } else if (i < n && data[i] == '\\n') {
+                i++;
+            }
+        }
+        flags[*count - 1] |= ZERO_CSV_ROW_END;
+        return i;
+    }
+}
+
+/* Scans as many complete rows as there is room for, or only the first if
+   one_row is set. Returns the number of fields recorded, and sets *consumed
+   to the position after the last complete row, or returns ZERO_CSV_INVALID
+   or ZERO_CSV_TOO_MANY_FIELDS if no row could be recorded. */
+ssize_t Zero_csv_scan(const uint8_t *data, size_t n, uint8_t delim,
+                      uint8_t quote, int final, int one_row, size_t *starts,
+                      size_t *ends, uint8_t *flags, size_t max_fields,
+                      size_t *consumed) {
+    size_t count = 0;
+    size_t row_count;
+    ssize_t res;
+    *consumed = 0;
+    while (*consumed < n) {
+        row_count = count;
+        res = Zero_csv_row(data, n, *consumed, delim, quote, final, starts,
+                           ends, flags, max_fields, &count);
+        if (res < 0) {
+            if (res == ZERO_CSV_INCOMPLETE || row_count > 0) {
+                return row_count;
+            }
+            return res;
+        }
+        *consumed = res;
+        if (one_row) {
+            break;
+        }
+    }
+    return count;
+}
 """, extra_compile_args=["-D_GNU_SOURCE"])
 
 BLOOM_WIDTH = _ffi.sizeof("long") * 8
+_EMPTY = _ffi.new("uint8_t[]", 0)
+FNV_OFFSET_BASIS = 14695981039346656037
+
+NEEDLE_CACHE_SIZE = 256
+PARALLEL_MIN_CHUNK_SIZE = 1024 * 1024
+_needle_cache = {}
+_shared_buffers = weakref.WeakValueDictionary()
+# Shared memory starts with a header holding the number of references to it,
+# padded so that the data after it stays aligned.
+_SHARED_HEADER_SIZE = 64
+_live_buffers = weakref.WeakKeyDictionary()
+_tracking = bool(os.environ.get("ZERO_BUFFER_TRACKING"))
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+_hooks = []
+_clock = getattr(time, "perf_counter", time.time)
+
+
+def add_hook(hook):
+    _hooks.append(hook)
+
+
+def remove_hook(hook):
+    _hooks.remove(hook)
+
+
+def _trace(op, func, *args):
+    start = _clock()
+    nbytes = 0
+    try:
+        result = func(*args)
+        if isinstance(result, six.integer_types):
+            nbytes = result
+        else:
+            nbytes = len(result)
+        return result
+    finally:
+        duration = _clock() - start
+        for hook in tuple(_hooks):
+            hook(op, nbytes, duration)
 
 
 class BufferFull(Exception):
     pass
 
 
+class HTTPParseError(ValueError):
+    pass
+
+
+class CSVParseError(ValueError):
+    pass
+
+
+def _bloom_add(mask, c):
+    return mask | (1 << (c & (BLOOM_WIDTH - 1)))
+
+
+class Needle(object):
+    def __init__(self, needle):
+        if isinstance(needle, BufferView):
+            needle = bytes(needle)
+        elif not isinstance(needle, bytes):
+            # bytes() would turn an integer into that many zero bytes.
+            needle = memoryview(needle).tobytes()
+        self._bytes = needle
+        if needle:
+            self._first = six.indexbytes(needle, 0)
+        # The bloom filter masks and skips are only used by the pure Python
+        # search, so they are built the first time it needs them.
+        self._find_mask = self._rfind_mask = None
+
+    def __repr__(self):
+        return "Needle(%r)" % (self._bytes,)
+
+    def __bytes__(self):
+        return self._bytes
+    if six.PY2:
+        __str__ = __bytes__
+
+    def __len__(self):
+        return len(self._bytes)
+
+    def _find_table(self):
+        if self._find_mask is None:
+            self._find_mask, self._find_skip = self._make_find_mask(
+                self._bytes
+            )
+        return self._find_mask, self._find_skip
+
+    def _rfind_table(self):
+        if self._rfind_mask is None:
+            self._rfind_mask, self._rfind_skip = self._make_rfind_mask(
+                self._bytes
+            )
+        return self._rfind_mask, self._rfind_skip
+
+    def _make_find_mask(self, needle):
+        mlast = len(needle) - 1
+        mask = 0
+        skip = mlast - 1
+        for i in xrange(mlast):
+            mask = _bloom_add(mask, six.indexbytes(needle, i))
+            if needle[i] == needle[mlast]:
+                skip = mlast - i - 1
+        mask = _bloom_add(mask, six.indexbytes(needle, mlast))
+        return mask, skip
+
+    def _make_rfind_mask(self, needle):
+        mask = _bloom_add(0, six.indexbytes(needle, 0))
+        skip = len(needle) - 1
+        for i in xrange(len(needle) - 1, 0, -1):
+            mask = _bloom_add(mask, six.indexbytes(needle, i))
+            if needle[i] == needle[0]:
+                skip = i - 1
+        return mask, skip
+
+
+def _clamp_indices(start, stop, length):
+    # The same as slice(start, stop).indices(length), except that start isn't
+    # clamped to the length, because bytes.find(b"", start) returns -1 when
+    # start is after the end.
+    if stop is None:
+        stop = length
+    elif stop < 0:
+        stop = max(stop + length, 0)
+    else:
+        stop = min(stop, length)
+    if start < 0:
+        start = max(start + length, 0)
+    return start, stop
+
+
+def compile_needle(needle):
+    if isinstance(needle, Needle):
+        return needle
+    elif not isinstance(needle, bytes):
+        return Needle(needle)
+    try:
+        return _needle_cache[needle]
+    except KeyError:
+        pass
+    if len(_needle_cache) >= NEEDLE_CACHE_SIZE:
+        _needle_cache.clear()
+    compiled = _needle_cache[needle] = Needle(needle)
+    return compiled
+
+
 class Buffer(object):
     def __init__(self, data, writepos):
         self._data = data
+        # The memory which views of this buffer point into, which is kept
+        # after release() unless the views have been emptied.
+        self._owner = data
         self._writepos = writepos
+        self._views = None
+        if _tracking:
+            self._views = []
+            self._prune_views_at = 16
+            _live_buffers[self] = None
 
     @classmethod
     def allocate(cls, size):
         return cls(_ffi.new("uint8_t[]", size), 0)
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.release()
+
+    def _track_view(self, view):
+        views = self._views
+        views.append(weakref.ref(view))
+        if len(views) > self._prune_views_at:
+            views[:] = [ref for ref in views if ref() is not None]
+            self._prune_views_at = max(16, 2 * len(views))
+
+    def live_views(self):
+        if self._views is None:
+            raise ValueError(
+                "The buffer was created without tracking enabled"
+            )
+        views = (ref() for ref in self._views)
+        return [view for view in views if view is not None]
+
+    def release(self):
+        if self._views is not None:
+            # Views hold raw pointers into our memory, so turn every one of
+            # them into an empty view before dropping our reference to it.
+            for view in self.live_views():
+                view._data = _EMPTY + 0
+                view._length = 0
+            del self._views[:]
+            self._owner = _EMPTY
+        self._data = _EMPTY
+        self._writepos = 0
+
     def __repr__(self):
         return "Buffer(data=%r, capacity=%d, free=%d)" % (
             [self._data[i] for i in xrange(self.writepos)],
             self.capacity, self.free
         )
 
+    @classmethod
+    def allocate_shared(cls, size):
+        from multiprocessing import shared_memory
+
+        shm = shared_memory.SharedMemory(
+            create=True, size=_SHARED_HEADER_SIZE + size
+        )
+        data, refcount = _map_shared_memory(shm, size, create=True)
+        return SharedBuffer(data, 0, shm.name, refcount)
+
     @property
     def writepos(self):
         return self._writepos
@@ -75,6 +733,11 @@ class Buffer(object):
         return self.capacity - self.writepos
 
     def read_from(self, fd):
+        if _hooks:
+            return _trace("read_from", self._read_from, fd)
+        return self._read_from(fd)
+
+    def _read_from(self, fd):
         if not self.free:
             raise BufferFull
         res = _lib.read(fd, self._data + self.writepos, self.free)
@@ -89,11 +752,40 @@ class Buffer(object):
         if not self.free:
             raise BufferFull
         bytes_written = min(len(b), self.free)
-        for i in xrange(bytes_written):
-            self._data[self.writepos] = six.indexbytes(b, i)
-            self._writepos += 1
+        if isinstance(b, BufferView):
+            b = b._data
+        elif not isinstance(b, bytes):
+            b = _ffi.from_buffer(b)
+        _lib.memcpy(self._data + self.writepos, b, bytes_written)
+        self._writepos += bytes_written
         return bytes_written
 
+    def reserve(self, n):
+        if n < 0:
+            raise ValueError("n is negative")
+        if n > self.free:
+            raise BufferFull
+        data = memoryview(_ffi.buffer(self._data))
+        return data[self.writepos:self.writepos + n]
+
+    def commit(self, n):
+        if not (0 <= n <= self.free):
+            raise ValueError("n is negative or larger than the free space")
+        self._writepos += n
+
+    def pack_into(self, fmt, *values):
+        if struct.calcsize(fmt) > self.free:
+            raise BufferFull
+        offset = self.writepos
+        struct.pack_into(fmt, _ffi.buffer(self._data), offset, *values)
+        self._writepos += struct.calcsize(fmt)
+        return offset
+
+    def pack_at(self, offset, fmt, *values):
+        if not (0 <= offset <= self.writepos - struct.calcsize(fmt)):
+            raise ValueError("The packed values aren't before the writepos")
+        struct.pack_into(fmt, _ffi.buffer(self._data), offset, *values)
+
     def view(self, start=0, stop=None):
         if stop is None:
             stop = self.writepos
@@ -108,17 +800,91 @@ class Buffer(object):
         return BufferView(self, self._data, start, stop)
 
 
+def _map_shared_memory(shm, size, create=False):
+    # Each process's mapping holds one reference, which is dropped once
+    # nothing in that process uses the memory. Whichever process drops the
+    # last reference unlinks the memory.
+    owner = _ffi.from_buffer("uint8_t[]", shm.buf)
+    refcount = _ffi.cast("int64_t *", owner)
+    if create:
+        refcount[0] = 1
+
+    def close(ptr):
+        remaining = _lib.Zero_atomic_add(refcount, -1)
+        _ffi.release(owner)
+        shm.close()
+        if remaining == 0:
+            shm.unlink()
+
+    ptr = _ffi.gc(_ffi.cast("uint8_t *", owner), close)
+    mapped = memoryview(_ffi.buffer(ptr, _SHARED_HEADER_SIZE + size))
+    data = _ffi.from_buffer("uint8_t[]", mapped[_SHARED_HEADER_SIZE:])
+    return data, refcount
+
+
+def _attach_shared_view(name, start, stop):
+    # The pickled view holds a reference, which a new mapping takes over.
+    buf = _shared_buffers.get(name)
+    if buf is None:
+        from multiprocessing import shared_memory
+
+        shm = shared_memory.SharedMemory(name=name)
+        data, refcount = _map_shared_memory(
+            shm, len(shm.buf) - _SHARED_HEADER_SIZE
+        )
+        buf = SharedBuffer(data, len(data), name, refcount)
+    else:
+        _lib.Zero_atomic_add(buf._refcount, -1)
+    return BufferView(buf, buf._data, start, stop)
+
+
+class SharedBuffer(Buffer):
+    def __init__(self, data, writepos, name, refcount):
+        super(SharedBuffer, self).__init__(data, writepos)
+        self._name = name
+        self._refcount = refcount
+        _shared_buffers[name] = self
+
+    def release(self):
+        # Views unpickled from now on have to map the memory again.
+        if _shared_buffers.get(self._name) is self:
+            del _shared_buffers[self._name]
+        self._refcount = None
+        super(SharedBuffer, self).release()
+
+    @property
+    def name(self):
+        return self._name
+
+
 class BufferView(object):
     def __init__(self, buf, data, start, stop):
         self._keepalive = buf
         self._data = data + start
         self._length = stop - start
+        if buf._views is not None:
+            buf._track_view(self)
 
     def __bytes__(self):
         return _ffi.buffer(self._data, self._length)[:]
     if six.PY2:
         __str__ = __bytes__
 
+    def __reduce__(self):
+        if not isinstance(self._keepalive, SharedBuffer):
+            raise TypeError(
+                "Only views of buffers from Buffer.allocate_shared can be "
+                "pickled"
+            )
+        buf = self._keepalive
+        if buf._refcount is None:
+            raise ValueError("The buffer has been released")
+        # The reference is dropped when the view is unpickled, so the memory
+        # stays alive even if every other process has finished with it.
+        _lib.Zero_atomic_add(buf._refcount, 1)
+        start = self._data - buf._data
+        return _attach_shared_view, (buf.name, start, start + len(self))
+
     def __repr__(self):
         return "BufferView(data=%r)" % (
             [self._data[i] for i in xrange(len(self))]
@@ -143,6 +909,13 @@ class BufferView(object):
     def __ne__(self, other):
         return not (self == other)
 
+    def equals_ignore_case(self, other):
+        if len(self) != len(other):
+            return False
+        if isinstance(other, BufferView):
+            other = other._data
+        return _lib.Zero_ascii_casecmp(self._data, other, len(self)) == 0
+
     def __contains__(self, data):
         return self.find(data) != -1
 
@@ -161,6 +934,24 @@ class BufferView(object):
                 raise IndexError(idx)
             return self._data[idx]
 
+    def __iter__(self):
+        if six.PY2:
+            return iter(bytearray(_ffi.buffer(self._data, self._length)))
+        # Iterate over the Buffer's own memory, rather than over self._data,
+        # so that the iterator keeps that memory alive.
+        start = self._data - self._keepalive._owner
+        data = memoryview(_ffi.buffer(self._keepalive._owner))
+        return iter(data[start:start + self._length])
+
+    def iter_chunks(self, size):
+        if size <= 0:
+            raise ValueError("size must be positive")
+        return self._iter_chunks(size)
+
+    def _iter_chunks(self, size):
+        for start in xrange(0, len(self), size):
+            yield self[start:start + size]
+
     def __add__(self, other):
         if isinstance(other, BufferView):
             collator = BufferCollator()
@@ -170,55 +961,55 @@ class BufferView(object):
         else:
             return NotImplemented
 
-    def find(self, needle, start=0, stop=None):
-        stop = stop or len(self)
-        if start < 0:
-            start = 0
-        if stop > len(self):
-            stop = len(self)
-        if stop - start < 0:
+    def find(self, needle, start=0, stop=None, ignore_case=False):
+        start, stop = _clamp_indices(start, stop, len(self))
+        if start > stop:
             return -1
 
+        needle = compile_needle(needle)
         if len(needle) == 0:
             return start
+        elif ignore_case:
+            res = _lib.Zero_find_ignore_case(
+                self._data + start, stop - start, needle._bytes, len(needle)
+            )
+            if res == -1:
+                return -1
+            else:
+                return start + res
         elif len(needle) == 1:
-            res = _lib.memchr(self._data + start, ord(needle), stop - start)
+            res = _lib.memchr(self._data + start, needle._first, stop - start)
             if res == _ffi.NULL:
                 return -1
             else:
                 return _ffi.cast("uint8_t *", res) - self._data
         else:
-            mask, skip = self._make_find_mask(needle)
-            return self._multi_char_find(needle, start, stop, mask, skip)
+            return self._multi_char_find(needle, start, stop)
 
-    def index(self, needle, start=0, stop=None):
-        idx = self.find(needle, start, stop)
+    def index(self, needle, start=0, stop=None, ignore_case=False):
+        idx = self.find(needle, start, stop, ignore_case)
         if idx == -1:
             raise ValueError("substring not found")
         return idx
 
     def rfind(self, needle, start=0, stop=None):
-        stop = stop or len(self)
-        if start < 0:
-            start = 0
-        if stop > len(self):
-            stop = len(self)
-        if stop - start < 0:
+        start, stop = _clamp_indices(start, stop, len(self))
+        if start > stop:
             return -1
 
+        needle = compile_needle(needle)
         if len(needle) == 0:
-            return start
+            return stop
         elif len(needle) == 1:
             res = _lib.Zero_memrchr(
-                self._data + start, ord(needle), stop - start
+                self._data + start, needle._first, stop - start
             )
             if res == _ffi.NULL:
                 return -1
             else:
                 return _ffi.cast("uint8_t *", res) - self._data
         else:
-            mask, skip = self._make_rfind_mask(needle)
-            return self._multi_char_rfind(needle, start, stop, mask, skip)
+            return self._multi_char_rfind(needle, start, stop)
 
     def rindex(self, needle, start=0, stop=None):
         idx = self.rfind(needle, start, stop)
@@ -227,6 +1018,7 @@ class BufferView(object):
         return idx
 
     def split(self, by, maxsplit=-1):
+        by = compile_needle(by)
         if len(by) == 0:
             raise ValueError("empty separator")
         elif len(by) == 1:
@@ -247,9 +1039,8 @@ class BufferView(object):
 
     def _split_multi_char(self, by, maxsplit):
         start = 0
-        mask, skip = self._make_find_mask(by)
         while maxsplit != 0:
-            next = self._multi_char_find(by, start, len(self), mask, skip)
+            next = self._multi_char_find(by, start, len(self))
             if next < 0:
                 break
             yield self[start:next]
@@ -257,24 +1048,12 @@ class BufferView(object):
             maxsplit -= 1
         yield self[start:]
 
-    def _bloom_add(self, mask, c):
-        return mask | (1 << (c & (BLOOM_WIDTH - 1)))
-
     def _bloom(self, mask, c):
         return mask & (1 << (c & (BLOOM_WIDTH - 1)))
 
-    def _make_find_mask(self, needle):
-        mlast = len(needle) - 1
-        mask = 0
-        skip = mlast - 1
-        for i in xrange(mlast):
-            mask = self._bloom_add(mask, six.indexbytes(needle, i))
-            if needle[i] == needle[mlast]:
-                skip = mlast - i - 1
-        mask = self._bloom_add(mask, six.indexbytes(needle, mlast))
-        return mask, skip
-
-    def _multi_char_find(self, needle, start, stop, mask, skip):
+    def _python_multi_char_find(self, needle, start, stop):
+        mask, skip = needle._find_table()
+        needle = needle._bytes
         i = start - 1
         w = (stop - start) - len(needle)
         while i + 1 <= start + w:
@@ -300,16 +1079,9 @@ class BufferView(object):
                     i += len(needle)
         return -1
 
-    def _make_rfind_mask(self, needle):
-        mask = self._bloom_add(0, six.indexbytes(needle, 0))
-        skip = len(needle) - 1
-        for i in xrange(len(needle) - 1, 0, -1):
-            mask = self._bloom_add(mask, six.indexbytes(needle, i))
-            if needle[i] == needle[0]:
-                skip = i - 1
-        return mask, skip
-
-    def _multi_char_rfind(self, needle, start, stop, mask, skip):
+    def _python_multi_char_rfind(self, needle, start, stop):
+        mask, skip = needle._rfind_table()
+        needle = needle._bytes
         i = start + (stop - start - len(needle)) + 1
         while i - 1 >= start:
             i -= 1
@@ -328,7 +1100,25 @@ class BufferView(object):
                     i -= len(needle)
         return -1
 
-    def splitlines(self, keepends=False):
+    def _native_multi_char_find(self, needle, start, stop):
+        res = _lib.Zero_find(
+            self._data + start, stop - start, needle._bytes, len(needle)
+        )
+        if res == -1:
+            return -1
+        else:
+            return start + res
+
+    def _native_multi_char_rfind(self, needle, start, stop):
+        res = _lib.Zero_rfind(
+            self._data + start, stop - start, needle._bytes, len(needle)
+        )
+        if res == -1:
+            return -1
+        else:
+            return start + res
+
+    def _python_splitlines(self, keepends=False):
         i = 0
         j = 0
         while j < len(self):
@@ -351,7 +1141,36 @@ class BufferView(object):
             yield self[j:eol]
             j = i
 
-    def isspace(self):
+    def _native_splitlines(self, keepends=False):
+        i = 0
+        while i < len(self):
+            eol = i + _lib.Zero_find_eol(self._data + i, len(self) - i)
+            j = eol
+            if eol < len(self):
+                if (
+                    self._data[eol] == ord(b"\r") and
+                    eol + 1 < len(self) and self._data[eol + 1] == ord(b"\n")
+                ):
+                    j += 2
+                else:
+                    j += 1
+                if keepends:
+                    eol = j
+            yield self[i:eol]
+            i = j
+
+    def decode(self, encoding="utf-8", errors="strict"):
+        return six.text_type(
+            _ffi.buffer(self._data, self._length), encoding, errors
+        )
+
+    def is_ascii(self):
+        return bool(_lib.Zero_is_ascii(self._data, self._length))
+
+    def is_valid_utf8(self):
+        return bool(_lib.Zero_is_valid_utf8(self._data, self._length))
+
+    def _python_isspace(self):
         if not self:
             return False
         for ch in self:
@@ -359,7 +1178,7 @@ class BufferView(object):
                 return False
         return True
 
-    def isdigit(self):
+    def _python_isdigit(self):
         if not self:
             return False
         for ch in self:
@@ -367,7 +1186,7 @@ class BufferView(object):
                 return False
         return True
 
-    def isalpha(self):
+    def _python_isalpha(self):
         if not self:
             return False
         for ch in self:
@@ -375,20 +1194,38 @@ class BufferView(object):
                 return False
         return True
 
-    def _strip_none(self, left, right):
+    def _native_isspace(self):
+        return self._native_all_in(_SPACE_TABLE)
+
+    def _native_isdigit(self):
+        return self._native_all_in(_DIGIT_TABLE)
+
+    def _native_isalpha(self):
+        return self._native_all_in(_ALPHA_TABLE)
+
+    def _native_all_in(self, table):
+        return bool(self) and (
+            _lib.Zero_span(self._data, self._length, table) == self._length
+        )
+
+    def _python_strip_none(self, left, right):
         lpos = 0
         rpos = len(self)
 
         if left:
-            while lpos < rpos and chr(self[lpos]).isspace():
+            while lpos < rpos and (
+                self[lpos] == 32 or 9 <= self[lpos] <= 13
+            ):
                 lpos += 1
 
         if right:
-            while rpos > lpos and chr(self[rpos - 1]).isspace():
+            while rpos > lpos and (
+                self[rpos - 1] == 32 or 9 <= self[rpos - 1] <= 13
+            ):
                 rpos -= 1
         return self[lpos:rpos]
 
-    def _strip_chars(self, chars, left, right):
+    def _python_strip_chars(self, chars, left, right):
         lpos = 0
         rpos = len(self)
 
@@ -401,6 +1238,24 @@ class BufferView(object):
                 rpos -= 1
         return self[lpos:rpos]
 
+    def _native_strip_none(self, left, right):
+        return self._native_strip(_SPACE_TABLE, left, right)
+
+    def _native_strip_chars(self, chars, left, right):
+        table = _ffi.new("uint8_t[256]")
+        for c in six.iterbytes(chars):
+            table[c] = 1
+        return self._native_strip(table, left, right)
+
+    def _native_strip(self, table, left, right):
+        lpos = 0
+        rpos = self._length
+        if left:
+            lpos = _lib.Zero_span(self._data, rpos, table)
+        if right:
+            rpos -= _lib.Zero_rspan(self._data + lpos, rpos - lpos, table)
+        return self[lpos:rpos]
+
     def strip(self, chars=None):
         if chars is None:
             return self._strip_none(left=True, right=True)
@@ -419,12 +1274,278 @@ class BufferView(object):
         else:
             return self._strip_chars(chars, left=False, right=True)
 
+    def crc32(self, value=0):
+        crc = zlib.crc32(_ffi.buffer(self._data, self._length), value)
+        return crc & 0xffffffff
+
+    def update_hash(self, hasher):
+        hasher.update(_ffi.buffer(self._data, self._length))
+
+    def hash(self, algorithm="sha256"):
+        hasher = hashlib.new(algorithm)
+        self.update_hash(hasher)
+        return hasher
+
+    def fast_hash(self, value=FNV_OFFSET_BASIS):
+        return _lib.Zero_fnv1a(self._data, self._length, value)
+
+    def as_array(self, dtype="uint8"):
+        import numpy
+
+        dtype = numpy.dtype(dtype)
+        if len(self) % dtype.itemsize:
+            raise ValueError(
+                "The length of the view is not a multiple of the itemsize"
+            )
+        # Build the array over the Buffer's own memory, rather than over
+        # self._data, so that the array keeps that memory alive.
+        array = numpy.frombuffer(
+            _ffi.buffer(self._keepalive._owner),
+            dtype=dtype,
+            count=len(self) // dtype.itemsize,
+            offset=self._data - self._keepalive._owner,
+        )
+        array.flags.writeable = False
+        return array
+
+    def as_records(self, dtype):
+        import numpy
+
+        return self.as_array(dtype).view(numpy.recarray)
+
+    def count_bytes(self):
+        import numpy
+
+        return numpy.bincount(self.as_array(), minlength=256)
+
+    def split_offsets(self, by, maxsplit=-1):
+        import numpy
+
+        by = compile_needle(by)
+        if len(by) == 0:
+            raise ValueError("empty separator")
+        elif len(by) == 1:
+            seps = numpy.flatnonzero(self.as_array() == by._first)
+        else:
+            seps = []
+            pos = self.find(by)
+            while pos != -1 and len(seps) != maxsplit:
+                seps.append(pos)
+                pos = self.find(by, pos + len(by))
+            seps = numpy.array(seps, dtype=numpy.intp)
+        if maxsplit >= 0:
+            seps = seps[:maxsplit]
+        offsets = numpy.empty((len(seps) + 1, 2), dtype=numpy.intp)
+        offsets[0, 0] = 0
+        offsets[1:, 0] = seps + len(by)
+        offsets[:-1, 1] = seps
+        offsets[-1, 1] = len(self)
+        return offsets
+
+    def detach(self):
+        data = _ffi.new("uint8_t[]", self._length)
+        _lib.memcpy(data, self._data, self._length)
+        return Buffer(data, self._length).view()
+
+    def _translate_into(self, buf, upper):
+        if buf.free < len(self):
+            raise BufferFull
+        start = buf.writepos
+        _lib.Zero_ascii_translate(
+            buf._data + start, self._data, self._length, upper
+        )
+        buf._writepos += len(self)
+        return buf.view(start)
+
+    def lower_into(self, buf):
+        return self._translate_into(buf, upper=False)
+
+    def upper_into(self, buf):
+        return self._translate_into(buf, upper=True)
+
     def write_to(self, fd):
+        if _hooks:
+            return _trace("write_to", self._write_to, fd)
+        return self._write_to(fd)
+
+    def _write_to(self, fd):
         res = _lib.write(fd, self._data, self._length)
         if res == -1:
             raise OSError(_ffi.errno, os.strerror(_ffi.errno))
         return res
 
+    def write_all(self, fd):
+        if _hooks:
+            return _trace("write_all", self._write_all, fd)
+        return self._write_all(fd)
+
+    def _write_all(self, fd):
+        written = _ffi.new("size_t *")
+        err = _lib.Zero_write_all(fd, self._data, self._length, written)
+        if err in (errno.EAGAIN, errno.EWOULDBLOCK):
+            # Say how much was written, so the caller can carry on from there.
+            raise io.BlockingIOError(err, os.strerror(err), written[0])
+        elif err:
+            raise OSError(err, os.strerror(err))
+        return written[0]
+
+
+def _byte_table(predicate):
+    table = _ffi.new("uint8_t[256]")
+    for c in xrange(256):
+        table[c] = bool(predicate(c))
+    return table
+
+
+_SPACE_TABLE = _byte_table(lambda c: c == 32 or 9 <= c <= 13)
+_DIGIT_TABLE = _byte_table(lambda c: ord("0") <= c <= ord("9"))
+_ALPHA_TABLE = _byte_table(lambda c: 65 <= c <= 90 or 97 <= c <= 122)
+
+BACKENDS = ("native", "python")
+# The BufferView methods which each backend has its own version of, named
+# "_<backend>_<method>".
+_BACKEND_METHODS = (
+    "_multi_char_find", "_multi_char_rfind", "splitlines", "isspace",
+    "isdigit", "isalpha", "_strip_none", "_strip_chars",
+)
+_backend = None
+
+
+def _default_backend():
+    backend = os.environ.get("ZERO_BUFFER_BACKEND")
+    if backend:
+        return backend
+    elif platform.python_implementation() == "PyPy":
+        # PyPy's JIT compiles the pure Python loops into faster code than
+        # calling into C for each operation.
+        return "python"
+    else:
+        return "native"
+
+
+def get_backend():
+    return _backend
+
+
+def set_backend(name):
+    global _backend
+    if name not in BACKENDS:
+        raise ValueError("Unknown backend: %r" % (name,))
+    for method in _BACKEND_METHODS:
+        impl = BufferView.__dict__["_%s_%s" % (name, method.lstrip("_"))]
+        setattr(BufferView, method, impl)
+    _backend = name
+
+
+set_backend(_default_backend())
+
+
+def set_tracking(enabled):
+    global _tracking
+    _tracking = bool(enabled)
+
+
+def live_buffers():
+    return [(buf, buf.live_views()) for buf in list(_live_buffers.keys())]
+
+
+def read_many(pairs, timeout=None):
+    pairs = list(pairs)
+    results = [None] * len(pairs)
+    pending = []
+    for i, (fd, buf) in enumerate(pairs):
+        if fd < 0:
+            # poll() ignores negative file descriptors rather than reporting
+            # them, which would leave us waiting on them forever.
+            results[i] = OSError(errno.EBADF, os.strerror(errno.EBADF))
+        elif buf.free:
+            pending.append(i)
+        else:
+            results[i] = BufferFull()
+    if not pending:
+        return results
+
+    n = len(pending)
+    fds = _ffi.new("int[]", n)
+    bufs = _ffi.new("uint8_t *[]", n)
+    sizes = _ffi.new("size_t[]", n)
+    for j, i in enumerate(pending):
+        fd, buf = pairs[i]
+        fds[j] = fd
+        bufs[j] = buf._data + buf.writepos
+        sizes[j] = buf.free
+    reads = _ffi.new("ssize_t[]", n)
+    errors = _ffi.new("int[]", n)
+    if timeout is None:
+        timeout = -1
+    else:
+        timeout = int(timeout * 1000)
+    err = _lib.Zero_read_many(n, fds, bufs, sizes, timeout, reads, errors)
+    if err:
+        raise OSError(err, os.strerror(err))
+
+    for j, i in enumerate(pending):
+        res = reads[j]
+        if res == -2:
+            continue
+        elif res == -1:
+            results[i] = OSError(errors[j], os.strerror(errors[j]))
+        elif res == 0:
+            results[i] = EOFError()
+        else:
+            pairs[i][1]._writepos += res
+            results[i] = res
+    return results
+
+
+class Writer(object):
+    def __init__(self, source):
+        if isinstance(source, BufferCollator):
+            self._views = list(source._views)
+        else:
+            self._views = [source]
+        # Releasing a buffer empties its views, so their lengths are kept to
+        # notice that rather than waiting forever for the missing bytes.
+        self._lengths = [len(view) for view in self._views]
+        self._offset = 0
+        self._remaining = sum(self._lengths)
+        self._written = _ffi.new("size_t *")
+
+    def __len__(self):
+        return self._remaining
+
+    @property
+    def done(self):
+        return self._remaining == 0
+
+    def write_to(self, fd):
+        if _hooks:
+            return _trace("write_to", self._write_to, fd)
+        return self._write_to(fd)
+
+    def _write_to(self, fd):
+        total = 0
+        while self._views:
+            view = self._views[0]
+            if len(view) != self._lengths[0]:
+                raise ValueError("The buffer has been released")
+            err = _lib.Zero_write_all(
+                fd, view._data + self._offset, len(view) - self._offset,
+                self._written
+            )
+            res = self._written[0]
+            total += res
+            self._offset += res
+            self._remaining -= res
+            if err in (errno.EAGAIN, errno.EWOULDBLOCK):
+                break
+            elif err:
+                raise OSError(err, os.strerror(err))
+            del self._views[0]
+            del self._lengths[0]
+            self._offset = 0
+        return total
+
 
 class BufferCollator(object):
     def __init__(self):
@@ -453,7 +1574,150 @@ class BufferCollator(object):
             self._views.append(view)
         self._total_length += len(view)
 
+    def crc32(self, value=0):
+        for view in self._views:
+            value = view.crc32(value)
+        return value
+
+    def update_hash(self, hasher):
+        for view in self._views:
+            view.update_hash(hasher)
+
+    def fast_hash(self, value=FNV_OFFSET_BASIS):
+        for view in self._views:
+            value = view.fast_hash(value)
+        return value
+
+    def _offsets(self):
+        offsets = []
+        pos = 0
+        for view in self._views:
+            offsets.append(pos)
+            pos += len(view)
+        return offsets
+
+    def _segment(self, pos, offsets):
+        return max(bisect.bisect_right(offsets, pos) - 1, 0)
+
+    def _slice(self, start, stop, offsets):
+        if not self._views:
+            return Buffer(_EMPTY, 0).view()
+        i = self._segment(start, offsets)
+        pos = start - offsets[i]
+        if stop - offsets[i] <= len(self._views[i]):
+            return self._views[i][pos:stop - offsets[i]]
+        # The piece spans several views, so copy just that piece.
+        data = _ffi.new("uint8_t[]", stop - start)
+        written = 0
+        while written < stop - start:
+            view = self._views[i]
+            n = min(len(view) - pos, stop - start - written)
+            _lib.memcpy(data + written, view._data + pos, n)
+            written += n
+            pos = 0
+            i += 1
+        return Buffer(data, stop - start).view()
+
+    def find(self, needle, start=0, stop=None):
+        start, stop = _clamp_indices(start, stop, self._total_length)
+        if start > stop:
+            return -1
+        needle = compile_needle(needle)
+        if len(needle) == 0:
+            return start
+        return self._find(needle, start, stop, self._offsets())
+
+    def _find(self, needle, start, stop, offsets):
+        m = len(needle)
+        for i in xrange(self._segment(start, offsets), len(self._views)):
+            view = self._views[i]
+            seg_start = offsets[i]
+            seg_end = seg_start + len(view)
+            if seg_start >= stop:
+                break
+            lo = max(start, seg_start) - seg_start
+            hi = min(stop, seg_end) - seg_start
+            if hi - lo >= m:
+                idx = view.find(needle, lo, hi)
+                if idx != -1:
+                    return seg_start + idx
+            # Matches starting in this view and ending in a later one.
+            if m > 1 and seg_end < stop:
+                w_start = max(seg_end - (m - 1), start)
+                w_stop = min(seg_end + (m - 1), stop)
+                if w_stop - w_start >= m:
+                    idx = self._slice(w_start, w_stop, offsets).find(needle)
+                    if idx != -1:
+                        return w_start + idx
+        return -1
+
+    def rfind(self, needle, start=0, stop=None):
+        start, stop = _clamp_indices(start, stop, self._total_length)
+        if start > stop:
+            return -1
+        needle = compile_needle(needle)
+        if len(needle) == 0:
+            return stop
+        m = len(needle)
+        offsets = self._offsets()
+        for i in xrange(len(self._views) - 1, -1, -1):
+            view = self._views[i]
+            seg_start = offsets[i]
+            seg_end = seg_start + len(view)
+            if seg_end <= start:
+                break
+            if seg_start >= stop:
+                continue
+            if m > 1 and seg_end < stop:
+                w_start = max(seg_end - (m - 1), start)
+                w_stop = min(seg_end + (m - 1), stop)
+                if w_stop - w_start >= m:
+                    idx = self._slice(w_start, w_stop, offsets).rfind(needle)
+                    if idx != -1:
+                        return w_start + idx
+            lo = max(start, seg_start) - seg_start
+            hi = min(stop, seg_end) - seg_start
+            if hi - lo >= m:
+                idx = view.rfind(needle, lo, hi)
+                if idx != -1:
+                    return seg_start + idx
+        return -1
+
+    def split(self, by, maxsplit=-1):
+        by = compile_needle(by)
+        if len(by) == 0:
+            raise ValueError("empty separator")
+        return self._split(by, maxsplit)
+
+    def _split(self, by, maxsplit):
+        offsets = self._offsets()
+        start = 0
+        while maxsplit != 0:
+            next = self._find(by, start, self._total_length, offsets)
+            if next == -1:
+                break
+            yield self._slice(start, next, offsets)
+            start = next + len(by)
+            maxsplit -= 1
+        yield self._slice(start, self._total_length, offsets)
+
+    def _consume(self, n):
+        # Drops the first n bytes.
+        self._total_length -= n
+        while n:
+            view = self._views[0]
+            if n < len(view):
+                self._views[0] = view[n:]
+                break
+            del self._views[0]
+            n -= len(view)
+
     def collapse(self):
+        if _hooks:
+            return _trace("collapse", self._collapse)
+        return self._collapse()
+
+    def _collapse(self):
         if len(self._views) == 1:
             result = self._views[0]
         else:
@@ -466,3 +1730,689 @@ class BufferCollator(object):
         del self._views[:]
         self._total_length = 0
         return result
+
+
+class Matcher(object):
+    def __init__(self, patterns):
+        goto = [{}]
+        output = [-1]
+        self._lengths = []
+        # The automaton only records one pattern per state, so later copies
+        # of a pattern are reported alongside the first.
+        self._duplicates = {}
+        for idx, pattern in enumerate(patterns):
+            if len(pattern) == 0:
+                raise ValueError("empty pattern")
+            state = 0
+            for c in six.iterbytes(pattern):
+                next = goto[state].get(c)
+                if next is None:
+                    next = len(goto)
+                    goto[state][c] = next
+                    goto.append({})
+                    output.append(-1)
+                state = next
+            if output[state] == -1:
+                output[state] = idx
+            else:
+                self._duplicates.setdefault(output[state], []).append(idx)
+            self._lengths.append(len(pattern))
+
+        nstates = len(goto)
+        fail = [0] * nstates
+        dict_link = [-1] * nstates
+        delta = _ffi.new("int32_t[]", nstates * 256)
+        queue = collections.deque()
+        for c, next in goto[0].items():
+            delta[c] = next
+            queue.append(next)
+        while queue:
+            state = queue.popleft()
+            f = fail[state]
+            if output[f] >= 0:
+                dict_link[state] = f
+            else:
+                dict_link[state] = dict_link[f]
+            _lib.memcpy(
+                delta + state * 256,
+                delta + f * 256,
+                _ffi.sizeof("int32_t") * 256
+            )
+            for c, next in goto[state].items():
+                fail[next] = delta[f * 256 + c]
+                delta[state * 256 + c] = next
+                queue.append(next)
+
+        self._delta = delta
+        self._output = _ffi.new("int32_t[]", output)
+        self._dict_link = _ffi.new("int32_t[]", dict_link)
+
+    def __len__(self):
+        return len(self._lengths)
+
+    def scan(self, data):
+        if isinstance(data, BufferCollator):
+            views = list(data._views)
+        else:
+            views = [data]
+        max_hits = len(self) + 1024
+        hit_patterns = _ffi.new("int32_t[]", max_hits)
+        hit_ends = _ffi.new("size_t[]", max_hits)
+        state = _ffi.new("int32_t *")
+        pos = _ffi.new("size_t *")
+        duplicates = self._duplicates
+        base = 0
+        for view in views:
+            pos[0] = 0
+            while pos[0] < len(view):
+                nhits = _lib.Zero_ac_scan(
+                    self._delta, self._output, self._dict_link, len(self),
+                    state, view._data, len(view), pos,
+                    hit_patterns, hit_ends, max_hits
+                )
+                for i in xrange(nhits):
+                    idx = hit_patterns[i]
+                    offset = base + hit_ends[i] - self._lengths[idx]
+                    yield idx, offset
+                    if duplicates and idx in duplicates:
+                        for duplicate in duplicates[idx]:
+                            yield duplicate, offset
+            base += len(view)
+
+
+class HTTPRequest(object):
+    def __init__(self, method, target, version, headers):
+        self.method = method
+        self.target = target
+        self.version = version
+        self.headers = headers
+
+    def __repr__(self):
+        return "HTTPRequest(method=%r, target=%r, version=%r)" % (
+            bytes(self.method), bytes(self.target), bytes(self.version)
+        )
+
+    def get_headers(self, name):
+        return [
+            value for key, value in self.headers
+            if key.equals_ignore_case(name)
+        ]
+
+    def get_header(self, name, default=None):
+        values = self.get_headers(name)
+        if values:
+            return values[0]
+        return default
+
+
+class HTTPParser(object):
+    def __init__(self, max_head_size=65536):
+        self.max_head_size = max_head_size
+        self._pending = BufferCollator()
+        self._scanned = 0
+        # How much of each Buffer has been fed already, so a Buffer which is
+        # read into and fed again only adds the new data.
+        self._fed = weakref.WeakKeyDictionary()
+
+    def feed(self, data):
+        if isinstance(data, Buffer):
+            views = [data.view(self._fed.get(data, 0))]
+            self._fed[data] = data.writepos
+        elif isinstance(data, BufferCollator):
+            views = data._views
+        else:
+            views = [data]
+        for view in views:
+            self._pending.append(view)
+
+    def take(self):
+        self._scanned = 0
+        return self._pending.collapse()
+
+    def parse(self):
+        pending = self._pending
+        end = pending.find(b"\r\n\r\n", max(self._scanned - 3, 0))
+        if end == -1:
+            self._scanned = len(pending)
+            if self._scanned > self.max_head_size:
+                raise HTTPParseError("request head is too large")
+            return None
+        if end > self.max_head_size:
+            raise HTTPParseError("request head is too large")
+        # Only a head which spans several views is copied; the data after it
+        # stays as views of the buffers it was read into.
+        head = pending._slice(0, end, pending._offsets())
+        pending._consume(end + 4)
+        self._scanned = 0
+        return self._parse_head(head)
+
+    def _parse_head(self, head):
+        lines = head.split(b"\r\n")
+        parts = list(next(lines).split(b" "))
+        if len(parts) != 3 or parts[2][:5] != b"HTTP/":
+            raise HTTPParseError("invalid request line")
+        method, target, version = parts
+        headers = []
+        for line in lines:
+            colon = line.find(b":")
+            if colon <= 0 or line[colon - 1] in (9, 32) or line[0] in (9, 32):
+                raise HTTPParseError("invalid header line")
+            headers.append((line[:colon], line[colon + 1:].strip(b" \t")))
+        return HTTPRequest(method, target, version, headers)
+
+
+class FrameReader(object):
+    def __init__(self, fd, prefix=">I", buffer_size=8192,
+                 max_frame_size=None):
+        self._fd = fd
+        if prefix == "varint":
+            self._prefix = None
+        else:
+            self._prefix = struct.Struct(prefix)
+        self._buffer_size = buffer_size
+        self._max_frame_size = max_frame_size
+        self._buffer = Buffer.allocate(buffer_size)
+        self._pos = 0
+        self._needed = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        while True:
+            frame = self._next_frame()
+            if frame is not None:
+                return frame
+            if not self._fill():
+                if self._buffer.writepos > self._pos:
+                    raise EOFError("truncated frame")
+                raise StopIteration
+    next = __next__
+
+    def _decode_prefix(self, available):
+        if self._prefix is not None:
+            if available < self._prefix.size:
+                return None
+            (length,) = self._prefix.unpack_from(
+                _ffi.buffer(self._buffer._data), self._pos
+            )
+            return self._prefix.size, length
+        length = 0
+        for i in xrange(min(available, 10)):
+            c = self._buffer._data[self._pos + i]
+            length |= (c & 0x7f) << (7 * i)
+            if not c & 0x80:
+                return i + 1, length
+        if available >= 10:
+            raise ValueError("varint length prefix is too long")
+        return None
+
+    def _next_frame(self):
+        available = self._buffer.writepos - self._pos
+        prefix = self._decode_prefix(available)
+        if prefix is None:
+            self._needed = available + 1
+            return None
+        prefix_size, length = prefix
+        if (
+            self._max_frame_size is not None and
+            length > self._max_frame_size
+        ):
+            raise ValueError("frame is larger than max_frame_size")
+        if available < prefix_size + length:
+            self._needed = prefix_size + length
+            return None
+        start = self._pos + prefix_size
+        self._pos = start + length
+        return self._buffer.view(start, self._pos)
+
+    def _fill(self):
+        if self._pos + self._needed > self._buffer.capacity:
+            # The rest of the frame doesn't fit in this buffer, so move the
+            # part of it that has been read into a new one which it will.
+            pending = self._buffer.writepos - self._pos
+            data = _ffi.new(
+                "uint8_t[]", max(self._buffer_size, self._needed)
+            )
+            _lib.memcpy(data, self._buffer._data + self._pos, pending)
+            self._buffer = Buffer(data, pending)
+            self._pos = 0
+        try:
+            self._buffer.read_from(self._fd)
+        except EOFError:
+            return False
+        return True
+
+
+def _parallel_chunks(view, sep, workers):
+    # Chunk boundaries are moved forwards until no occurrence of sep spans
+    # them, which makes scanning each chunk independently give the same
+    # results as scanning the whole view.
+    chunk_size = max(len(view) // workers, PARALLEL_MIN_CHUNK_SIZE, 1)
+    bounds = [0]
+    pos = chunk_size
+    while pos < len(view):
+        while len(sep) > 1:
+            idx = view.find(
+                sep, max(pos - len(sep) + 1, 0), pos + len(sep) - 1
+            )
+            if idx == -1 or idx >= pos:
+                break
+            pos = idx + len(sep)
+        if pos >= len(view):
+            break
+        bounds.append(pos)
+        pos += chunk_size
+    bounds.append(len(view))
+    return [(bounds[i], bounds[i + 1]) for i in xrange(len(bounds) - 1)]
+
+
+def _get_pool():
+    # One pool, with a thread per CPU, is shared by every call. A child
+    # process doesn't inherit the threads, so it creates its own.
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ThreadPool(multiprocessing.cpu_count())
+            _pool_pid = os.getpid()
+        return _pool
+
+
+@atexit.register
+def _close_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None and _pool_pid == os.getpid():
+            _pool.close()
+            _pool.join()
+        _pool = None
+
+
+def _parallel_map(func, view, sep, workers):
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    sep = compile_needle(sep)._bytes
+    if len(sep) == 0:
+        raise ValueError("empty separator")
+    chunks = _parallel_chunks(view, sep, workers)
+    if len(chunks) == 1:
+        return [func(view, sep, chunks[0])]
+    return _get_pool().map(lambda chunk: func(view, sep, chunk), chunks)
+
+
+def _count_chunk(view, sep, chunk):
+    start, stop = chunk
+    return _lib.Zero_find_all(
+        view._data + start, stop - start, sep, len(sep), _ffi.NULL, 0
+    )
+
+
+def _find_all_chunk(view, sep, chunk):
+    # The chunk is scanned once, filling arrays of offsets which are each
+    # twice the size of the last, rather than counting the matches first.
+    pos, stop = chunk
+    results = []
+    size = 64
+    while True:
+        offsets = _ffi.new("size_t[]", size)
+        count = _lib.Zero_find_all(
+            view._data + pos, stop - pos, sep, len(sep), offsets, size
+        )
+        results.append((pos, offsets, count))
+        if count < size:
+            return results
+        pos += offsets[count - 1] + len(sep)
+        size *= 2
+
+
+def parallel_count(view, sep, workers=None):
+    return sum(_parallel_map(_count_chunk, view, sep, workers))
+
+
+def parallel_split(view, sep, workers=None):
+    results = _parallel_map(_find_all_chunk, view, sep, workers)
+    return _parallel_split(view, results, len(compile_needle(sep)))
+
+
+def _parallel_split(view, results, sep_length):
+    prev = 0
+    for chunk_results in results:
+        for start, offsets, count in chunk_results:
+            for i in xrange(count):
+                pos = start + offsets[i]
+                yield view[prev:pos]
+                prev = pos + sep_length
+    yield view[prev:]
+
+
+_ZLIB_WBITS = {
+    "zlib": zlib.MAX_WBITS,
+    "gzip": 16 + zlib.MAX_WBITS,
+    "deflate": -zlib.MAX_WBITS,
+}
+
+
+class _LZ4Compressor(object):
+    def __init__(self, level):
+        import lz4.frame
+
+        self._compressor = lz4.frame.LZ4FrameCompressor(
+            compression_level=level or 0
+        )
+        self._header = self._compressor.begin()
+
+    def _take_header(self):
+        header, self._header = self._header, b""
+        return header
+
+    def compress(self, data):
+        return self._take_header() + self._compressor.compress(data)
+
+    def flush(self):
+        return self._take_header() + self._compressor.flush()
+
+
+class _LZ4Decompressor(object):
+    def __init__(self):
+        import lz4.frame
+
+        self._decompressor = lz4.frame.LZ4FrameDecompressor()
+
+    def decompress(self, data):
+        return self._decompressor.decompress(data)
+
+    def flush(self):
+        return b""
+
+
+def _make_compressor(codec, level):
+    if codec in _ZLIB_WBITS:
+        if level is None:
+            level = zlib.Z_DEFAULT_COMPRESSION
+        return zlib.compressobj(level, zlib.DEFLATED, _ZLIB_WBITS[codec])
+    elif codec == "zstd":
+        import zstandard
+
+        if level is None:
+            level = 3
+        return zstandard.ZstdCompressor(level=level).compressobj()
+    elif codec == "lz4":
+        return _LZ4Compressor(level)
+    raise ValueError("Unknown codec: %r" % (codec,))
+
+
+def _make_decompressor(codec):
+    if codec in _ZLIB_WBITS:
+        return zlib.decompressobj(_ZLIB_WBITS[codec])
+    elif codec == "zstd":
+        import zstandard
+
+        return zstandard.ZstdDecompressor().decompressobj()
+    elif codec == "lz4":
+        return _LZ4Decompressor()
+    raise ValueError("Unknown codec: %r" % (codec,))
+
+
+class _CodecStage(object):
+    def __init__(self, codec, buffer_size):
+        self._codec = codec
+        self._buffer_size = buffer_size
+        self._buffer = Buffer.allocate(buffer_size)
+
+    def _emit(self, data, views):
+        if not data:
+            return
+        if len(data) > self._buffer.free:
+            self._buffer = Buffer.allocate(max(self._buffer_size, len(data)))
+        start = self._buffer.writepos
+        self._buffer.add_bytes(data)
+        views.append(self._buffer.view(start))
+
+    def _process(self, func, data):
+        if isinstance(data, BufferCollator):
+            inputs = data._views
+        else:
+            inputs = [data]
+        views = []
+        for view in inputs:
+            self._emit(func(_ffi.buffer(view._data, len(view))), views)
+        return views
+
+    def flush(self):
+        views = []
+        self._emit(self._codec.flush(), views)
+        return views
+
+
+class Compressor(_CodecStage):
+    def __init__(self, codec="zlib", level=None, buffer_size=8192):
+        super(Compressor, self).__init__(
+            _make_compressor(codec, level), buffer_size
+        )
+
+    def feed(self, data):
+        return self._process(self._codec.compress, data)
+
+
+class Decompressor(_CodecStage):
+    def __init__(self, codec="zlib", buffer_size=8192):
+        super(Decompressor, self).__init__(
+            _make_decompressor(codec), buffer_size
+        )
+
+    def feed(self, data):
+        return self._process(self._codec.decompress, data)
+
+
+class CSVReader(object):
+    def __init__(self, delimiter=b",", quotechar=b'"'):
+        if len(delimiter) != 1 or len(quotechar) != 1:
+            raise ValueError("delimiter and quotechar must be a single byte")
+        self._delimiter = six.indexbytes(delimiter, 0)
+        self._quotechar = quotechar
+        self._escaped_quote = quotechar * 2
+        self._pending = None
+        self._allocate_fields(64)
+
+    def _allocate_fields(self, max_fields):
+        self._max_fields = max_fields
+        self._starts = _ffi.new("size_t[]", max_fields)
+        self._ends = _ffi.new("size_t[]", max_fields)
+        self._flags = _ffi.new("uint8_t[]", max_fields)
+        self._consumed = _ffi.new("size_t *")
+
+    def feed(self, data):
+        if isinstance(data, Buffer):
+            views = [data.view()]
+        elif isinstance(data, BufferCollator):
+            views = data._views
+        else:
+            views = [data]
+        rows = []
+        for view in views:
+            if self._pending is not None:
+                view = self._finish_row(view, rows)
+                if view is None:
+                    continue
+            view_rows, pos = self._scan(view, final=False)
+            rows.extend(view_rows)
+            self._pending = view[pos:] if pos < len(view) else None
+        return rows
+
+    def close(self):
+        if self._pending is None:
+            return []
+        rows, _ = self._scan(self._pending, final=True)
+        self._pending = None
+        return rows
+
+    def _finish_row(self, view, rows):
+        # Only the row which straddles the end of the previous data is
+        # copied: join it with just enough of view to complete it, then
+        # return the rest of view to be scanned in place.
+        if not view:
+            return None
+        pending = self._pending
+        stop = 0
+        while True:
+            eols = [
+                idx for idx in [view.find(b"\n", stop), view.find(b"\r", stop)]
+                if idx != -1
+            ]
+            if eols:
+                # Take at least double the last attempt, so that a row with
+                # many quoted newlines isn't copied over and over. The extra
+                # byte is for a "\n" after a "\r".
+                stop = min(max(min(eols) + 2, 2 * stop), len(view))
+            else:
+                stop = len(view)
+            joined = pending + view[:stop]
+            row, pos = self._scan(joined, final=False, one_row=True)
+            if row:
+                rows.extend(row)
+                self._pending = None
+                return view[pos - len(pending):]
+            elif stop == len(view):
+                self._pending = joined
+                return None
+
+    def _scan(self, view, final, one_row=False):
+        rows = []
+        pos = 0
+        row = []
+        while pos < len(view):
+            count = _lib.Zero_csv_scan(
+                view._data + pos, len(view) - pos, self._delimiter,
+                six.indexbytes(self._quotechar, 0), final, one_row,
+                self._starts, self._ends, self._flags, self._max_fields,
+                self._consumed
+            )
+            if count == _lib.ZERO_CSV_TOO_MANY_FIELDS:
+                self._allocate_fields(self._max_fields * 2)
+                continue
+            elif count == _lib.ZERO_CSV_INVALID:
+                raise CSVParseError("unexpected data after a closing quote")
+            elif count == 0:
+                break
+            for i in xrange(count):
+                field = view[pos + self._starts[i]:pos + self._ends[i]]
+                flags = self._flags[i]
+                if flags & _lib.ZERO_CSV_ESCAPED:
+                    field = self._unescape(field)
+                row.append(field)
+                if flags & _lib.ZERO_CSV_ROW_END:
+                    # Like the csv module, a blank line is an empty row.
+                    if (
+                        len(row) == 1 and not row[0] and
+                        not flags & _lib.ZERO_CSV_QUOTED
+                    ):
+                        row = []
+                    rows.append(row)
+                    row = []
+            pos += self._consumed[0]
+            if one_row:
+                break
+        return rows, pos
+
+    def _unescape(self, field):
+        data = bytes(field).replace(self._escaped_quote, self._quotechar)
+        buf = Buffer.allocate(len(data))
+        buf.add_bytes(data)
+        return buf.view()
+
+
+class LatencyHistogram(object):
+    # Durations are recorded in nanoseconds, in buckets which are exact below
+    # 2 ** significant_bits and otherwise cover a range 2 ** -(bits - 1) of
+    # their lower bound wide, like an HDR histogram.
+    def __init__(self, significant_bits=5):
+        self._significant_bits = significant_bits
+        self._buckets = {}
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def _bucket(self, ns):
+        shift = max(math.frexp(ns)[1] - self._significant_bits, 0)
+        return (ns >> shift) << shift, 1 << shift
+
+    def record(self, duration):
+        ns = max(int(duration * 1e9), 0)
+        lower, width = self._bucket(ns)
+        self._buckets[lower] = self._buckets.get(lower, 0) + 1
+        self.count += 1
+        self.total += duration
+        if self.min is None or duration < self.min:
+            self.min = duration
+        if self.max is None or duration > self.max:
+            self.max = duration
+
+    def percentile(self, p):
+        if not self.count:
+            return None
+        threshold = self.count * p / 100.0
+        seen = 0
+        for lower in sorted(self._buckets):
+            seen += self._buckets[lower]
+            if seen >= threshold:
+                _, width = self._bucket(lower)
+                return min((lower + width - 1) / 1e9, self.max)
+        return self.max
+
+    def as_dict(self):
+        return {
+            "count": self.count,
+            "total": self.total,
+            "min": self.min,
+            "max": self.max,
+            "mean": self.total / self.count if self.count else None,
+            "percentiles": dict(
+                (p, self.percentile(p)) for p in (50, 90, 99, 99.9)
+            ),
+            "buckets": [
+                (lower / 1e9, self._buckets[lower])
+                for lower in sorted(self._buckets)
+            ],
+        }
+
+
+def _size_class(nbytes):
+    if nbytes <= 0:
+        return 0
+    return 1 << math.frexp(nbytes - 1)[1]
+
+
+class Profiler(object):
+    def __init__(self, significant_bits=5):
+        self._significant_bits = significant_bits
+        self._histograms = {}
+
+    def __enter__(self):
+        add_hook(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        remove_hook(self)
+
+    def __call__(self, op, nbytes, duration):
+        for key in [(op, None), (op, _size_class(nbytes))]:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = LatencyHistogram(
+                    self._significant_bits
+                )
+            histogram.record(duration)
+
+    def histogram(self, op, size_class=None):
+        return self._histograms.get((op, size_class))
+
+    def as_dict(self):
+        result = {}
+        for (op, size_class), histogram in self._histograms.items():
+            entry = result.setdefault(op, {"total": None, "sizes": {}})
+            if size_class is None:
+                entry["total"] = histogram.as_dict()
+            else:
+                entry["sizes"][size_class] = histogram.as_dict()
+        return result